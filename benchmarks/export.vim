@@ -0,0 +1,31 @@
+" Cost of calling exported Python functions from Vim, with and without the
+" pyeval() trampoline. Needs a Vim with +python:
+"
+"   vim -Nu NONE -S benchmarks/export.vim
+
+python << EOF
+import sys, vim
+sys.path.insert(0, vim.eval('expand("<sfile>:p:h:h")'))
+from pyunite.decorators import export
+
+def fast_call(arglead, cmdline, cursorpos):
+    return [arglead, cmdline, cursorpos]
+
+def heredoc_call(arglead, cmdline, cursorpos):
+    return [arglead, cmdline, cursorpos]
+
+export(fast=True)(fast_call)
+export(fast=False)(heredoc_call)
+EOF
+
+function! s:per_call(func, count)
+  let start = reltime()
+  for i in range(a:count)
+    call call(a:func, ['-sc', 'PyUniteStart -sc', i])
+  endfor
+  return reltimefloat(reltime(start)) * 1000000 / a:count
+endfunction
+
+let s:count = 20000
+echom printf('pyeval trampoline: %6.1f us/call', s:per_call(function('s:fast_call'), s:count))
+echom printf('python heredoc:    %6.1f us/call', s:per_call(function('s:heredoc_call'), s:count))
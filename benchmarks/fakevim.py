@@ -0,0 +1,543 @@
+''' In-process stand-in for Vim's 'vim' module.
+
+It models what PyUnite uses: buffers, windows and tabpages with their options
+and variables, plus enough of vim.command() and vim.eval() to run the Ex
+commands and expressions PyUnite issues. Everything else is accepted and
+ignored. Every call going through the Python/Vim bridge is counted in
+'counters', so that benchmarks can tell how chatty PyUnite is.
+
+Install it before importing pyunite:
+
+    import sys, fakevim
+    sys.modules['vim'] = fakevim
+'''
+import re
+from collections import defaultdict
+
+
+class error(Exception):
+    pass
+
+
+# Kind of bridge call -> number of calls
+counters = defaultdict(int)
+
+
+def bridge_calls():
+    return sum(counters.values())
+
+
+buffer_option_defaults = dict(
+    bufhidden = '',
+    buflisted = True,
+    buftype = '',
+    completefunc = '',
+    omnifunc = '',
+    iskeyword = '@,48-57,_,192-255',
+    modified = False,
+    matchpairs = '(:),{:},[:]',
+    modeline = True,
+    modifiable = True,
+    readonly = False,
+    swapfile = True,
+    undolevels = 1000,
+    filetype = '',
+)
+
+window_option_defaults = dict(
+    cursorbind = False,
+    conceallevel = 0,
+    concealcursor = '',
+    cursorcolumn = False,
+    colorcolumn = '',
+    relativenumber = False,
+    cursorline = False,
+    foldcolumn = 0,
+    foldenable = True,
+    list = False,
+    number = False,
+    scrollbind = False,
+    spell = False,
+)
+
+
+class Options(object):
+    def __init__(self, defaults):
+        self.values = dict(defaults)
+
+    def __getitem__(self, name):
+        counters['option'] += 1
+        if name not in self.values:
+            raise KeyError(name)
+        return self.values[name]
+
+    def __setitem__(self, name, value):
+        counters['option'] += 1
+        self.values[name] = value
+
+
+class Variables(dict):
+    def __getitem__(self, name):
+        counters['variable'] += 1
+        return dict.__getitem__(self, name)
+
+    def __setitem__(self, name, value):
+        counters['variable'] += 1
+        dict.__setitem__(self, name, value)
+
+    def get(self, name, default=None):
+        counters['variable'] += 1
+        return dict.get(self, name, default)
+
+
+class Buffer(object):
+    def __init__(self, number, name):
+        self.number = number
+        self._name = name
+        self.lines = ['']
+        self.options = Options(buffer_option_defaults)
+        self.vars = Variables()
+        self.valid = True
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        counters['buffer'] += 1
+        self._name = value
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        counters['buffer'] += 1
+        return iter(list(self.lines))
+
+    def __getitem__(self, i):
+        counters['buffer'] += 1
+        return self.lines[i]
+
+    def __setitem__(self, i, value):
+        counters['buffer'] += 1
+        if not self.options.values['modifiable']:
+            raise error('Vim:E21: Cannot make changes, \'modifiable\' is off')
+        if isinstance(i, slice):
+            self.lines[i] = [] if value is None else list(value)
+        elif value is None:
+            del self.lines[i]
+        else:
+            self.lines[i] = value
+        self.lines = self.lines or ['']
+
+    def __delitem__(self, i):
+        self[i] = None
+
+    def append(self, lines, nr=None):
+        counters['buffer'] += 1
+        if not self.options.values['modifiable']:
+            raise error('Vim:E21: Cannot make changes, \'modifiable\' is off')
+        lines = [lines] if isinstance(lines, basestring) else list(lines)
+        nr = len(self.lines) if nr is None else nr
+        self.lines[nr:nr] = lines
+
+
+class Window(object):
+    def __init__(self, tabpage, buff):
+        self.tabpage = tabpage
+        self.buffer = buff
+        self.options = Options(window_option_defaults)
+        self.vars = Variables()
+        self.cursor = (1, 0)
+        self.width = 80
+        self.height = 24
+        self.valid = True
+
+    @property
+    def number(self):
+        return self.tabpage.windows.index(self) + 1
+
+
+class TabPage(object):
+    def __init__(self):
+        self.windows = []
+        self.window = None
+        self.vars = Variables()
+        self.valid = True
+
+    @property
+    def number(self):
+        return tabpages.index(self) + 1
+
+
+class Buffers(object):
+    ''' vim.buffers: iterable, indexed by buffer number '''
+    def __init__(self):
+        self.by_number = {}
+
+    def __iter__(self):
+        return iter([self.by_number[x] for x in sorted(self.by_number)])
+
+    def __len__(self):
+        return len(self.by_number)
+
+    def __getitem__(self, number):
+        return self.by_number[number]
+
+
+class Windows(object):
+    ''' vim.windows: the windows of the current tabpage '''
+    def __iter__(self):
+        return iter(list(state['tabpage'].windows))
+
+    def __len__(self):
+        return len(state['tabpage'].windows)
+
+    def __getitem__(self, i):
+        return state['tabpage'].windows[i]
+
+
+class Current(object):
+    @property
+    def tabpage(self):
+        return state['tabpage']
+
+    @property
+    def window(self):
+        return state['tabpage'].window
+
+    @property
+    def buffer(self):
+        return state['tabpage'].window.buffer
+
+
+buffers = Buffers()
+tabpages = []
+windows = Windows()
+current = Current()
+vars = Variables()
+options = Options(dict(hidden=False, equalalways=True))
+state = dict(tabpage=None, next_buffer=1, next_timer=1, registers={})
+
+# Timer id -> (python function name, repeat)
+timers = {}
+
+# Messages echoed with :echom, :echon and :echoe
+messages = []
+
+
+def reset():
+    ''' Start over with a single tabpage showing an empty buffer '''
+    counters.clear()
+    buffers.by_number.clear()
+    del tabpages[:]
+    timers.clear()
+    del messages[:]
+    vars.clear()
+    state.update(tabpage=None, next_buffer=1, next_timer=1, registers={})
+    tabpage = TabPage()
+    tabpages.append(tabpage)
+    window = Window(tabpage, new_buffer(''))
+    tabpage.windows.append(window)
+    tabpage.window = window
+    state['tabpage'] = tabpage
+
+
+def new_buffer(name):
+    buff = Buffer(state['next_buffer'], name)
+    buffers.by_number[buff.number] = buff
+    state['next_buffer'] += 1
+    return buff
+
+
+def buffer_named(name):
+    for buff in buffers:
+        if name and buff.name == name:
+            return buff
+    return new_buffer(name)
+
+
+def displayed(buff):
+    return any(w.buffer is buff for t in tabpages for w in t.windows)
+
+
+def wipe(buff):
+    buff.valid = False
+    buffers.by_number.pop(buff.number, None)
+    for tabpage in tabpages:
+        for window in list(tabpage.windows):
+            if window.buffer is buff:
+                close(window)
+
+
+def abandon(buff):
+    ''' Called when a buffer stops being displayed in a window '''
+    if buff.valid and not displayed(buff) and buff.options.values['bufhidden'] in ('wipe', 'delete'):
+        wipe(buff)
+
+
+def show(window, buff):
+    old = window.buffer
+    window.buffer = buff
+    if old is not buff:
+        abandon(old)
+
+
+def close(window):
+    tabpage = window.tabpage
+    if len(tabpage.windows) == 1:
+        return
+    index = tabpage.windows.index(window)
+    tabpage.windows.remove(window)
+    window.valid = False
+    if tabpage.window is window:
+        tabpage.window = tabpage.windows[max(0, index - 1)]
+    abandon(window.buffer)
+
+
+# Ex commands ################################################################
+
+modifiers = re.compile(r'^\s*(?:(?:silent!?|noautocmd|keepalt|keepjumps|vertical|topleft|botright|leftabove|rightbelow|aboveleft|belowright)\s+)*')
+literal = re.compile(r"^(-?\d+|'(?:[^']|'')*')$")
+
+
+def unescape(name):
+    return re.sub(r'\\(.)', r'\1', name)
+
+
+def parse_literal(string):
+    string = string.strip()
+    if not literal.match(string):
+        return None
+    if string.startswith("'"):
+        return string[1:-1].replace("''", "'")
+    return int(string)
+
+
+def command(cmd):
+    counters['command'] += 1
+    lines = iter(cmd.split('\n'))
+    for line in lines:
+        if re.match(r'^\s*function!?\s', line):
+            # Function definitions are not modelled, skip their body
+            for line in lines:
+                if re.match(r'^\s*endf', line):
+                    break
+            continue
+        run(line)
+
+
+def run(line):
+    vertical = bool(re.search(r'\bvertical\b', line))
+    line = modifiers.sub('', line)
+    if line.startswith('redir =>'):
+        return redir(line)
+
+    match = re.match(r"^execute '(\w+)' fnameescape\('(.*)'\)$", line.strip())
+    if match:
+        return run('{} {}'.format(match.group(1), match.group(2).replace("''", "'")))
+
+    match = re.match(r'^(\d*)(v?new|v?split)\s*(.*)$', line)
+    if match:
+        tabpage = state['tabpage']
+        window = Window(tabpage, buffer_named(unescape(match.group(3).strip())))
+        index = tabpage.windows.index(tabpage.window)
+        tabpage.windows.insert(index, window)
+        tabpage.window = window
+        if match.group(1):
+            setattr(window, 'width' if match.group(2) == 'vnew' else 'height', int(match.group(1)))
+        return
+
+    match = re.match(r'^(\d+)wincmd w$', line.strip())
+    if match:
+        tabpage = state['tabpage']
+        tabpage.window = tabpage.windows[min(int(match.group(1)), len(tabpage.windows)) - 1]
+        return
+
+    match = re.match(r'^pedit!?\s+(.*)$', line)
+    if match:
+        tabpage = state['tabpage']
+        buff = buffer_named(unescape(match.group(1).strip()))
+        preview = [x for x in tabpage.windows if getattr(x, 'preview', False)]
+        if preview:
+            return show(preview[0], buff)
+        window = Window(tabpage, buff)
+        window.preview = True
+        tabpage.windows.insert(0, window)
+        return
+
+    match = re.match(r'^wincmd ([Pp])$', line.strip())
+    if match:
+        tabpage = state['tabpage']
+        if match.group(1) == 'P':
+            preview = [x for x in tabpage.windows if getattr(x, 'preview', False)]
+            if preview:
+                tabpage.previous, tabpage.window = tabpage.window, preview[0]
+        elif getattr(tabpage, 'previous', None) in tabpage.windows:
+            tabpage.previous, tabpage.window = tabpage.window, tabpage.previous
+        return
+
+    match = re.match(r'^tabnext (\d+)$', line.strip())
+    if match:
+        state['tabpage'] = tabpages[int(match.group(1)) - 1]
+        return
+
+    match = re.match(r'^resize (\d+)$', line.strip())
+    if match:
+        setattr(current.window, 'width' if vertical else 'height', int(match.group(1)))
+        return
+
+    if re.match(r'^close!?$', line.strip()):
+        return close(current.window)
+
+    match = re.match(r'^edit!?\s+(.*)$', line)
+    if match:
+        return show(current.window, buffer_named(unescape(match.group(1).strip())))
+
+    match = re.match(r'^tabedit\s+(.*)$', line)
+    if match:
+        tabpage = TabPage()
+        tabpages.insert(tabpages.index(state['tabpage']) + 1, tabpage)
+        window = Window(tabpage, buffer_named(unescape(match.group(1).strip())))
+        tabpage.windows.append(window)
+        tabpage.window = window
+        state['tabpage'] = tabpage
+        return
+
+    match = re.match(r'^badd\s+(.*)$', line)
+    if match:
+        buffer_named(unescape(match.group(1).strip()))
+        return
+
+    match = re.match(r'^set (no)?(\w+)$', line.strip())
+    if match and match.group(2) in options.values:
+        options.values[match.group(2)] = not match.group(1)
+        return
+
+    match = re.match(r'^(\d+)buffer!?$', line.strip())
+    if match:
+        return show(current.window, buffers[int(match.group(1))])
+
+    match = re.match(r'^(?:bdelete|bwipeout|bunload)(!?)\s+([\d ]+)$', line.strip())
+    if match:
+        for number in match.group(2).split():
+            if int(number) in buffers.by_number:
+                if buffers[int(number)].options.values['modified'] and not match.group(1):
+                    raise error('Vim(bdelete):E89: No write since last change for buffer {} (add ! to override)'.format(number))
+                wipe(buffers[int(number)])
+        return
+
+    match = re.match(r"^call set(buf|win)var\((\d+), '&(\w+)', (.*)\)$", line.strip())
+    if match:
+        value = parse_literal(match.group(4))
+        if value is not None:
+            if match.group(1) == 'buf':
+                target = buffers.by_number.get(int(match.group(2)))
+            else:
+                windows = state['tabpage'].windows
+                number = int(match.group(2))
+                target = current.window if number == 0 else windows[number - 1]
+            if target is not None:
+                target.options.values[match.group(3)] = value
+        return
+
+    match = re.match(r"^echo[men]\s*'(.*)'$", line.strip())
+    if match:
+        messages.append(match.group(1).replace("''", "'"))
+        return
+
+    match = re.match(r'^unlet!?\s+(g:)?(\w+)$', line.strip())
+    if match:
+        vars.pop(match.group(2), None)
+
+
+def redir(line):
+    ''' redir => var | silent! cmd | redir END '''
+    parts = [modifiers.sub('', x).strip() for x in line.split('|')]
+    name = parts[0][len('redir =>'):].strip()
+    dict.__setitem__(vars, name, command_output(parts[1]))
+
+
+def command_output(cmd):
+    if cmd == 'ls':
+        return '\n' + '\n'.join(
+            '{:3d} {}a   "{}"    line 1'.format(
+                b.number,
+                '%' if b is current.buffer else ' ',
+                b.name or '[No Name]',
+            )
+            for b in buffers if b.options.values['buflisted']
+        )
+    return ''
+
+
+# Expressions ################################################################
+
+def eval(expr):
+    counters['eval'] += 1
+    expr = expr.strip()
+
+    match = re.match(r'^(has|exists)\(', expr)
+    if match:
+        return '1'
+
+    match = re.match(r"^timer_start\((\d+), function\('s:(\w+)'\)(, \{'repeat': (-?\d+)\})?\)$", expr)
+    if match:
+        timer = state['next_timer']
+        state['next_timer'] += 1
+        timers[timer] = (match.group(2), int(match.group(4) or 1))
+        return str(timer)
+
+    match = re.match(r'^timer_stop\((\d+)\)$', expr)
+    if match:
+        timers.pop(int(match.group(1)), None)
+        return '0'
+
+    match = re.match(r"""^filter\((\[[\d, ]*\]), 'getbufvar\(v:val, "&modified"\)'\)$""", expr)
+    if match:
+        numbers = [int(x) for x in re.findall(r'\d+', match.group(1))]
+        return [str(x) for x in numbers if x in buffers.by_number and buffers[x].options.values['modified']]
+
+    match = re.match(r"^get\(get\(getbufinfo\((\d+)\), 0, \{\}\), 'lnum', 1\)$", expr)
+    if match:
+        # Line of the cursor in a window showing the buffer
+        windows = [w for t in tabpages for w in t.windows if w.buffer.number == int(match.group(1))]
+        return str(windows[0].cursor[0] if windows else 1)
+
+    if expr == "[line('w0'), line('w$')]":
+        # The cursor line is kept in the middle of the window
+        window = current.window
+        top = max(1, min(window.cursor[0] - window.height // 2, len(window.buffer) - window.height + 1))
+        return [str(top), str(min(len(window.buffer), top + window.height - 1))]
+
+    if expr in ('getcmdtype()', 'getcmdline()'):
+        return ''
+
+    if re.match(r'^\w+$', expr):
+        if expr not in vars:
+            raise error('Vim:E121: Undefined variable: ' + expr)
+        return dict.__getitem__(vars, expr)
+
+    return ''
+
+
+def run_timers(limit=100000):
+    ''' Fire pending timers until there are none left (or 'limit' fired).
+    Returns the number of timers fired '''
+    from pyunite.decorators import functions
+    fired = 0
+    while timers and fired < limit:
+        for timer, (name, repeat) in sorted(timers.items()):
+            if repeat != -1:
+                repeat -= 1
+                if repeat <= 0:
+                    del timers[timer]
+                else:
+                    timers[timer] = (name, repeat)
+            functions[name](timer)
+            fired += 1
+    return fired
+
+
+reset()
@@ -0,0 +1,111 @@
+''' Times the grep source on a generated tree of source-like files.
+
+    python benchmarks/grep_tree.py [--files 100000] [--lines 50]
+                                   [--searchers 1,4] [--keep DIR]
+
+Reports when the first and the last chunk of candidates arrived and checks
+the lines found against a plain line by line search, also with two searches
+running at once.
+'''
+import os
+import re
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Importing the pyunite package imports its core, which needs a vim module
+import fakevim
+sys.modules['vim'] = fakevim
+
+from pyunite.sources import file_rec, grep
+
+
+def write_tree(root, files, lines):
+    for i in xrange(files):
+        directory = os.path.join(root, 'pkg{}'.format(i % 97), 'mod{}'.format(i % 1009))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, 'file{}.py'.format(i)), 'w') as f:
+            f.write(''.join(
+                'def function_{}_{}(value):  # {}\n'.format(i, j, 'TODO' if (i + j) % 997 == 0 else 'ok')
+                for j in xrange(lines)
+            ))
+
+
+def expected(root, pattern):
+    regex = re.compile(pattern)
+    found = set()
+    for directory, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            with open(path) as f:
+                for number, line in enumerate(f, 1):
+                    if regex.search(line):
+                        found.add('{}:{}:'.format(os.path.relpath(path, root), number))
+    return found
+
+
+def timed_search(root, pattern):
+    start = time.time()
+    first, found = None, set()
+    for chunk in grep.stream_candidates(pattern, root):
+        first = first or time.time() - start
+        found.update(x[len(root) + 1:] for x in chunk.pre)
+    return first, time.time() - start, found
+
+
+def interleaved_search(root, patterns):
+    ''' Searches run at once, their chunks read in turns '''
+    found = [set() for _ in patterns]
+    streams = zip([grep.stream_candidates(x, root) for x in patterns], found)
+    while streams:
+        for stream, lines in streams[:]:
+            chunk = next(stream, None)
+            if chunk is None:
+                streams.remove((stream, lines))
+            else:
+                lines.update(x[len(root) + 1:] for x in chunk.pre)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--lines', type=int, default=50)
+    parser.add_argument('--searchers', default='1,{}'.format(grep.cpu_count()))
+    parser.add_argument('--keep', help='Generate the tree in this directory (or reuse it) and keep it')
+    args = parser.parse_args()
+
+    root = os.path.realpath(args.keep or tempfile.mkdtemp())
+    file_rec.index_directory = tempfile.mkdtemp()
+    try:
+        if not os.listdir(root):
+            write_tree(root, args.files, args.lines)
+        pattern = 'TODO'
+        reference = expected(root, pattern)
+        failed = False
+        for searchers in sorted(set(map(int, args.searchers.split(',')))):
+            grep.pool.terminate()
+            grep.searchers, grep.pool = searchers, grep.Pool(searchers)
+            first, total, found = timed_search(root, pattern)
+            ok = found == reference
+            failed = failed or not ok
+            print('{:>2} searchers: first chunk {:>8.1f}ms, {:,} lines in {:>8.1f}ms  {}'.format(
+                searchers, first * 1000, len(found), total * 1000, 'ok' if ok else 'MISMATCH'))
+        others = expected(root, 'ok$')
+        concurrent = interleaved_search(root, ['ok$', pattern]) == [others, reference]
+        failed = failed or not concurrent
+        print('two searches at once: {}'.format('ok' if concurrent else 'MISMATCH'))
+    finally:
+        args.keep or shutil.rmtree(root)
+        shutil.rmtree(file_rec.index_directory)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+''' Headless benchmarks: drive core.start() end to end against fakevim.
+
+    python benchmarks/headless.py [--sizes 1000,100000] [--json results.json]
+                                  [--baseline results.json] [--tolerance 1.5]
+
+Each size runs in its own process, so that its peak memory is its own. For
+every scenario, it reports the latency of each phase (inclusive: buffer_logic
+contains populated_candidates, etc...), the peak resident memory so far and
+the number of calls made through the Python/Vim bridge.
+
+With --baseline, phases which got slower than 'tolerance' times the baseline
+(and by more than a millisecond) are listed and the exit status is 1.
+'''
+import os
+import sys
+import json
+import time
+import types
+import resource
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+default_sizes = [1000, 10000, 100000, 1000000, 5000000]
+
+# Functions of pyunite.core timed as phases
+phases = [
+    'buffer_logic',
+    'populated_candidates',
+    'unique_sources',
+    'ranked_sources',
+    'filter_sources',
+    'resume_filtering',
+    'aggregate_candidates',
+    'set_buffer_contents',
+    'window_logic',
+    'set_buffer_syntax',
+    'highlight_matches',
+]
+
+# Query typed one character at a time in the 'type' scenario
+typed_query = 'src7fi'
+
+
+def synthetic_paths(count, variant):
+    return (
+        '/home/user/{}/project{}/src{}/module{}/file{}.py'.format(variant, i % 97, i % 13, i % 1009, i)
+        for i in xrange(count)
+    )
+
+
+def synthetic_source(streamed, cache_ttl=0):
+    from pyunite.candidates import Candidates
+    from pyunite.actions import file_actions
+    module = types.ModuleType('synthetic_stream' if streamed else 'synthetic')
+    module.actions = file_actions
+    module.default_action = file_actions['window_open']
+    module.actionable_string = lambda action, candidate: candidate.filterable
+    module.cache_ttl = cache_ttl
+    # Number of times the candidates were gathered
+    module.gathers = 0
+    module.thread_safe = True
+    module.syntaxes = lambda: ['syntax match {source}_file /file\d\+/ contained']
+    module.highlights = lambda: ['highlight default link {source}_file Identifier']
+
+    def get_candidates(count, variant='a'):
+        module.gathers += 1
+        return Candidates.from_columns(list(synthetic_paths(int(count), variant)))
+
+    def stream_candidates(count, variant='a'):
+        paths = synthetic_paths(int(count), variant)
+        while True:
+            chunk = [x for _, x in zip(xrange(65536), paths)]
+            if not chunk:
+                break
+            yield Candidates.from_columns(chunk)
+
+    module.get_candidates = get_candidates
+    if streamed:
+        module.stream_candidates = stream_candidates
+    return module
+
+
+class Recorder(object):
+    ''' Wraps the phases of pyunite.core and accumulates their timings '''
+
+    def __init__(self, core):
+        self.timings = defaultdict(float)
+        for name in phases:
+            setattr(core, name, self.timed(name, getattr(core, name)))
+
+    def timed(self, name, func):
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.timings[name] += time.time() - start
+        return wrapper
+
+
+def peak_memory():
+    ''' Peak resident memory of this process, in MB '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_size(size):
+    import fakevim
+    sys.modules['vim'] = fakevim
+
+    from pyunite import core, sources, variables, frecency
+    sources.register('synthetic', synthetic_source(streamed=False))
+    # Some candidates were opened before, in a store of our own
+    frecency.path = os.path.join(tempfile.mkdtemp(), 'frecency')
+    visited = list(synthetic_paths(size, 'a'))[::max(1, size // frecency.max_entries)]
+    frecency.scores = dict((x, i * 0.01) for i, x in enumerate(visited))
+    sources.register('synthetic_stream', synthetic_source(streamed=True))
+    cached = synthetic_source(streamed=False, cache_ttl=3600)
+    sources.register('synthetic_cached', cached)
+    recorder = Recorder(core)
+
+    def pyunite_window():
+        return core.find(lambda w: w.buffer.vars.get('pyunite_uid'), fakevim.current.tabpage.windows)
+
+    def type_query():
+        core.change_window(pyunite_window())
+        core.flush()
+        for i in range(1, len(typed_query) + 1):
+            core.set_input(typed_query[:i])
+            fakevim.run_timers()
+
+    def stream():
+        core.start('synthetic_stream:{}'.format(size))
+        fakevim.run_timers()
+
+    def unique():
+        # Worst case: the streamed source is listed first, so it takes every
+        # path over from the other one as it arrives
+        core.start('-unique synthetic_stream:{0} synthetic:{0}'.format(size))
+        fakevim.run_timers()
+
+    def wiped():
+        # The state goes away with its window, its candidates stay cached
+        core.start('synthetic_cached:{}'.format(size))
+        core.vim_leave_pre()
+        gathers = cached.gathers
+        core.start('synthetic_cached:{}'.format(size))
+        assert cached.gathers == gathers, 'Cached candidates were gathered again'
+
+    scenarios = [
+        # A new buffer and window
+        ('open', lambda: core.start('synthetic:{}'.format(size))),
+        # Same sources: the buffer and its candidates are reused
+        ('reopen', lambda: core.start('synthetic:{}'.format(size))),
+        # Same sources, different input: filter without gathering again
+        ('filter', lambda: core.start('-input=file42 synthetic:{}'.format(size))),
+        # Interactive filtering: one set_input() per keystroke, and timers
+        ('type', type_query),
+        # Different sources: the buffer is replaced
+        ('replace', lambda: core.start('synthetic:{}:b'.format(size))),
+        # Candidates arrive from a stream, shown from timers
+        ('stream', stream),
+        # Two sources giving the same paths, deduplicated as they stream
+        ('unique', unique),
+        # Back to the state 'replace' dropped, from its snapshot
+        ('resume', lambda: core.start('-resume synthetic:{}'.format(size))),
+        ('close', core.vim_leave_pre),
+        # Open, close and open again: the second time from the cache
+        ('wiped', wiped),
+    ]
+
+    results = []
+    for name, scenario in scenarios:
+        recorder.timings.clear()
+        fakevim.counters.clear()
+        start = time.time()
+        scenario()
+        results.append(dict(
+            scenario = name,
+            total = time.time() - start,
+            phases = dict(recorder.timings),
+            bridge_calls = fakevim.bridge_calls(),
+            bridge_calls_by_kind = dict(fakevim.counters),
+            peak_memory = peak_memory(),
+            lines = sum(len(s['lines']) for s in variables.states),
+            messages = fakevim.messages[:],
+        ))
+        del fakevim.messages[:]
+    return results
+
+
+def run_all(sizes):
+    results = {}
+    for size in sizes:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', str(size)])
+        results[str(size)] = json.loads(output)
+        report(size, results[str(size)])
+    return results
+
+
+def report(size, results):
+    columns = ['total'] + phases
+    print('{:,} candidates'.format(size))
+    print('  {:<8}'.format('') + ''.join('{:>12}'.format(x[:11]) for x in columns) + '{:>9}{:>10}'.format('calls', 'peak MB'))
+    for result in results:
+        timings = dict(result['phases'], total=result['total'])
+        print('  {:<8}'.format(result['scenario']) + ''.join(
+            '{:>12}'.format('{:.1f}ms'.format(timings[x] * 1000) if x in timings else '-')
+            for x in columns
+        ) + '{:>9}{:>10.0f}'.format(result['bridge_calls'], result['peak_memory']))
+        for message in result['messages']:
+            print('    ' + message)
+    print('')
+    sys.stdout.flush()
+
+
+def regressions(results, baseline, tolerance):
+    for size, scenarios in sorted(results.items()):
+        old_scenarios = dict((x['scenario'], x) for x in baseline.get(size, []))
+        for result in scenarios:
+            old = old_scenarios.get(result['scenario'])
+            if not old:
+                continue
+            timings = dict(result['phases'], total=result['total'])
+            old_timings = dict(old['phases'], total=old['total'])
+            for phase, seconds in sorted(timings.items()):
+                before = old_timings.get(phase)
+                if before is not None and seconds > before * tolerance and seconds - before > 0.001:
+                    yield '{} candidates, {}, {}: {:.1f}ms -> {:.1f}ms'.format(
+                        size, result['scenario'], phase, before * 1000, seconds * 1000)
+            if result['bridge_calls'] > old['bridge_calls'] * tolerance:
+                yield '{} candidates, {}, bridge calls: {} -> {}'.format(
+                    size, result['scenario'], old['bridge_calls'], result['bridge_calls'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default=','.join(map(str, default_sizes)))
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--baseline', help='Results to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        json.dump(run_size(args.child), sys.stdout)
+        return 0
+
+    results = run_all(map(int, args.sizes.split(',')))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = list(regressions(results, json.load(f), args.tolerance))
+        for line in found:
+            print('Regression: ' + line)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
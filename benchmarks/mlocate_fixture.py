@@ -0,0 +1,138 @@
+''' Generates mlocate databases and checks pyunite.mlocate against them.
+
+    python benchmarks/mlocate_fixture.py [--tree DIR] [--directories 2000]
+                                         [--files 500] [--keep FILE]
+
+Without --tree, a synthetic tree of 'directories' x 'files' entries is
+written. Every prefix scan is compared with a plain sequential decoding of
+the whole database, and timed.
+'''
+import os
+import sys
+import time
+import struct
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Importing the pyunite package imports its core, which needs a vim module
+import fakevim
+sys.modules['vim'] = fakevim
+
+from pyunite.mlocate import Database
+
+
+# Chunk sizes every prefix is scanned with
+chunk_sizes = [65536, 100]
+
+
+def directory_order(path):
+    ''' updatedb sorts directories as if '/' came before any other character '''
+    return path.replace('/', '\0')
+
+
+def write_database(path, tree, root='/', check_visibility=False):
+    ''' 'tree' maps directory paths to [(name, is directory)] '''
+    config = 'prune_bind_mounts\0' '1\0' '\0' 'prunefs\0' '\0' 'prunenames\0' '\0' 'prunepaths\0' '\0'
+    with open(path, 'wb') as f:
+        f.write('\0mlocate' + struct.pack('>IBBxx', len(config), 0, int(check_visibility)))
+        f.write(root + '\0' + config)
+        for directory in sorted(tree, key=directory_order):
+            f.write(struct.pack('>QII', 1500000000, 123456789, 0) + directory + '\0')
+            for name, is_directory in sorted(tree[directory]):
+                f.write(chr(int(is_directory)) + name + '\0')
+            f.write('\x02')
+
+
+def tree_on_disk(root):
+    tree = {}
+    for directory, directories, files in os.walk(root):
+        tree[directory] = [(x, True) for x in directories] + [(x, False) for x in files]
+    return tree
+
+
+def synthetic_tree(directories, files):
+    tree = {'/': [('home', True)], '/home': [('user', True)], '/home/user': []}
+    for d in xrange(directories):
+        parent = '/home/user/project{}'.format(d % 20)
+        if parent not in tree:
+            tree['/home/user'].append((parent.rsplit('/', 1)[1], True))
+            tree[parent] = []
+        directory = '{}/dir{}'.format(parent, d)
+        tree[parent].append(('dir{}'.format(d), True))
+        tree[directory] = [('file{}.txt'.format(f), False) for f in xrange(files)]
+    return tree
+
+
+def decoded(path):
+    ''' Every path in a database (directories and their entries), decoded one
+    record at a time '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    config_size, = struct.unpack('>I', data[8:12])
+    position = data.index('\0', 16) + 1 + config_size
+    paths = []
+    while position < len(data):
+        position += 16
+        end = data.index('\0', position)
+        directory = data[position:end]
+        paths.append(directory)
+        position = end + 1
+        while data[position] != '\x02':
+            # Past the type, which is a NUL byte for files
+            end = data.index('\0', position + 1)
+            paths.append(directory.rstrip('/') + '/' + data[position + 1:end])
+            position = end + 1
+        position += 1
+    return sorted(set(paths))
+
+
+def expected(paths, prefix):
+    prefix = prefix.rstrip('/') or '/'
+    under = prefix if prefix == '/' else prefix + '/'
+    return [x for x in paths if x == prefix or x.startswith(under)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--tree', help='Directory to make a database of')
+    parser.add_argument('--directories', type=int, default=2000)
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--keep', help='Write the database to this file and keep it')
+    args = parser.parse_args()
+
+    if args.tree:
+        root = os.path.realpath(args.tree)
+        tree = tree_on_disk(root)
+    else:
+        root = '/'
+        tree = synthetic_tree(args.directories, args.files)
+    path = args.keep or tempfile.mktemp(suffix='.db')
+    write_database(path, tree, root)
+    paths = decoded(path)
+    print('{:,} paths, {:.1f} MB'.format(len(paths), os.path.getsize(path) / 1e6))
+
+    directories = sorted(tree, key=directory_order)
+    prefixes = ['/', root, directories[len(directories) // 2], directories[-1], root.rstrip('/') + '/missing']
+    failed = False
+    try:
+        with Database(path) as database:
+            # Small chunks check that paths aren't lost or repeated at the
+            # boundaries between chunks
+            for prefix, chunk_size in [(x, y) for y in chunk_sizes for x in prefixes]:
+                start = time.time()
+                found = [x for chunk in database.paths(prefix, chunk_size) for x in chunk]
+                elapsed = time.time() - start
+                ok = sorted(found) == expected(paths, prefix)
+                failed = failed or not ok
+                print('{:<40} {:>6} {:>9,} paths {:>9.1f}ms  {}'.format(
+                    prefix[-40:], chunk_size, len(found), elapsed * 1000, 'ok' if ok else 'MISMATCH'))
+    finally:
+        args.keep or os.remove(path)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
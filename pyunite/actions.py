@@ -1,7 +1,68 @@
+''' Actions run on the actionable strings of candidates (see
+'actionable_string' in the sources).
+
+An action takes one string. It can also have a 'batch' attribute: a function
+taking all the strings chosen at once, so that running it on many candidates
+costs one round-trip to Vim instead of one per candidate. See run_action.
+'''
 import vim
 import funcy as fn
-
-from .pure import *
+from itertools import imap
+from functools import partial, wraps
+
+from . import frecency, preview as previews
+from .batch import batched, command
+from .helpers import *
+from .exceptions import PyUniteWarning
+
+
+def run_action(action, strings):
+    ''' Run an action on strings, all at once if it has a batch form '''
+    batch = getattr(action, 'batch', None)
+    with batched():
+        if batch:
+            batch(strings)
+        else:
+            map(action, strings)
+
+
+def with_batch(batch):
+    ''' Give an action its batch form '''
+    def wrapper(action):
+        action.batch = batch
+        return action
+    return wrapper
+
+
+def visiting(action):
+    ''' Running the action on a string makes it more frecent, so that its
+    candidate is shown earlier next time. See frecency.py '''
+    @wraps(action)
+    def wrapper(string):
+        frecency.visit(string)
+        return action(string)
+    if hasattr(action, 'batch'):
+        def batch(strings):
+            map(frecency.visit, strings)
+            return action.batch(strings)
+        wrapper.batch = batch
+    return wrapper
+
+
+# str -> str -> str
+def file_command(cmd, path):
+    return "execute '{}' fnameescape({})".format(cmd, vim_literal(path))
+
+
+def open_in_windows(cmd, paths):
+    ''' Windows are split with 'equalalways' off and only made equal once,
+    instead of after every split '''
+    equalalways = vim.options['equalalways']
+    command('set noequalalways')
+    map(command, imap(partial(file_command, cmd), paths))
+    if equalalways:
+        command('set equalalways')
+        command('wincmd =')
 
 
 def send_to_cmdline(string):
@@ -13,17 +74,30 @@ common_actions = dict(
     send_to_cmdline = lambda x: vim.eval('feedkeys("' + escape_quote(x) + '")')
 )
 
+@visiting
+@with_batch(lambda paths: map(command, imap(partial(file_command, 'tabedit'), paths)))
 def tab_open(string):
-    pass
+    command(file_command('tabedit', string))
+
+def open_in_window(paths):
+    ''' Edit the first path, the others are only added to the buffer list '''
+    map(command, imap(partial(file_command, 'badd'), paths[1:]))
+    command(file_command('edit', paths[0]))
 
+@visiting
+@with_batch(open_in_window)
 def window_open(string):
-    pass
+    command(file_command('edit', string))
 
+@visiting
+@with_batch(partial(open_in_windows, 'split'))
 def split_open(string):
-    pass
+    command(file_command('split', string))
 
+@visiting
+@with_batch(partial(open_in_windows, 'vsplit'))
 def vsplit_open(string):
-    pass
+    command(file_command('vsplit', string))
 
 openable_actions = fn.merge(common_actions, dict(
     tab_open = tab_open,
@@ -45,11 +119,16 @@ def shell_cmd(string):
     # Run shell command on file
     pass
 
+def preview(string):
+    ''' Show the file in the preview window, at the line for 'path:line' '''
+    previews.show(string)
+
 file_actions = fn.merge(openable_actions, dict(
     read = read,
     rename = rename,
     remove = remove,
     shell_cmd = shell_cmd,
+    preview = preview,
 ))
 
 def cd(string):
@@ -74,15 +153,23 @@ def run_ex(string):
 def buf_rename(string):
     pass
 
-def buf_remove(string):
-    pass
+def buf_remove_all(buffers):
+    ''' A single :bdelete with all the buffers (numbers). Modified buffers
+    are kept rather than losing their changes to :bdelete! (plain :bdelete
+    would stop at the first one with E89) '''
+    modified = set(vim.eval("filter({}, 'getbufvar(v:val, \"&modified\")')".format(map(int, buffers))))
+    removed = [x for x in buffers if x not in modified]
+    if removed:
+        command('bdelete ' + ' '.join(removed))
+    if modified:
+        raise PyUniteWarning('Modified buffers kept: ' + ' '.join(x for x in buffers if x in modified))
 
-def preview(string):
-    pass
+@with_batch(buf_remove_all)
+def buf_remove(string):
+    buf_remove_all([string])
 
 buffer_actions = fn.merge(directory_actions, dict(
     run_ex = run_ex,
     rename = buf_rename,
     remove = buf_remove,
-    preview = preview,
 ))
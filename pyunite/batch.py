@@ -0,0 +1,56 @@
+''' Batching of Ex commands.
+
+Every vim.command() is a round-trip through the Python/Vim bridge. Commands
+issued with 'command' inside a 'batched' context are queued instead, and run
+with a single vim.command() when the outermost context exits or when 'flush'
+is called because something has to be read back from Vim. Queued commands are
+joined with newlines, which Vim treats like '|' (:h :bar) except that it also
+ends commands which take '|' as part of their argument (:autocmd, :map, ...).
+'''
+import vim
+from contextlib import contextmanager
+
+
+# Commands waiting to be run. None when not batching
+queue = None
+
+# Number of vim.command() calls made and of Ex commands run through them
+stats = dict(calls=0, commands=0)
+
+
+def command(cmd):
+    if queue is None:
+        execute([cmd])
+    else:
+        queue.append(cmd)
+
+
+def flush():
+    ''' Run the queued commands. Call it before reading anything they could
+    change (vim.current, window sizes, etc...) '''
+    if queue:
+        commands = queue[:]
+        del queue[:]
+        execute(commands)
+
+
+def execute(commands):
+    stats['calls'] += 1
+    stats['commands'] += len(commands)
+    vim.command('\n'.join(commands))
+
+
+@contextmanager
+def batched():
+    global queue
+    outermost = queue is None
+    if outermost:
+        queue = []
+    try:
+        yield
+    finally:
+        if outermost:
+            try:
+                flush()
+            finally:
+                queue = None
@@ -0,0 +1,71 @@
+''' Process-wide cache of candidates keyed by source name and arguments.
+
+What is actually cached is the matcher Index of the candidates, so that the
+lowercase blocks of text built while filtering are reused as well.
+
+Sources control caching through these optional module attributes:
+
+    cache_ttl: Seconds a cache entry stays valid. Zero disables caching.
+    cache_invalidated_by: Vim events which invalidate all the cache entries
+                          of the source (e.g. BufWritePost for the grep source).
+    cache_key(*args): What the candidates depend on besides the arguments,
+                      e.g. the directory they resolve to after a :cd.
+'''
+from collections import OrderedDict
+from time import time
+
+from . import sources
+
+
+# Used for sources without a 'cache_ttl' attribute
+default_ttl = 60
+
+# Max number of candidates held by the cache. Least recently used entries
+# are evicted first when it's exceeded
+max_candidates = 2000000
+
+# (source name, args) -> (expiration time, index)
+entries = OrderedDict()
+
+# Names of the sources whose invalidation autocommands have been set
+hooked = set()
+
+
+# source -> (str, tuple, a)
+def key(source):
+    args = tuple(source['args'])
+    cache_key = getattr(sources.get(source['name']), 'cache_key', None)
+    return (source['name'], args, cache_key(*args) if cache_key else None)
+
+
+def size():
+    return sum(len(index.candidates) for _, index in entries.itervalues())
+
+
+def get(source):
+    ''' Index of the source's candidates or None if it isn't cached '''
+    source_key = key(source)
+    entry = entries.pop(source_key, None)
+    if entry is None or entry[0] < time():
+        return None
+    # Put it back at the end, which is the most recently used one
+    entries[source_key] = entry
+    return entry[1]
+
+
+def put(source, index, ttl):
+    if ttl <= 0:
+        return
+    source_key = key(source)
+    entries.pop(source_key, None)
+    entries[source_key] = (time() + ttl, index)
+    total = size()
+    while total > max_candidates and len(entries) > 1:
+        _, (_, evicted) = entries.popitem(last=False)
+        total -= len(evicted.candidates)
+
+
+def invalidate(name=None):
+    ''' Drop the entries of a source, or all of them '''
+    for entry_key in [x for x in entries if name is None or x[0] == name]:
+        del entries[entry_key]
@@ -0,0 +1,250 @@
+''' Columnar storage for candidates.
+
+Keeping one namedtuple (plus three strings) per candidate gets expensive with
+millions of them. Candidates keeps each field in a Column instead, which packs
+its strings into a few big strings and an array of offsets. It still reads
+like a list of variables.candidate: they are built on demand.
+'''
+from array import array
+from bisect import bisect_right
+from itertools import imap, izip
+
+from .variables import candidate
+
+
+# Strings are packed once this many of them have been appended
+block_size = 4096
+
+
+class Column(object):
+    ''' List of strings packed into blocks. A block is a big string with the
+    end offset of each of its strings. Blocks made of empty strings only take
+    a counter '''
+
+    def __init__(self, strings=()):
+        self.blocks = []
+        # End offset of each string in its block, None if they're all empty
+        self.ends = []
+        # Number of strings up to the end of each block
+        self.counts = array('L')
+        # Strings which haven't been packed yet
+        self.tail = []
+        self.extend(strings)
+
+    def packed(self):
+        return self.counts[-1] if self.counts else 0
+
+    def __len__(self):
+        return self.packed() + len(self.tail)
+
+    def append(self, string):
+        self.tail.append(string)
+        if len(self.tail) >= block_size:
+            self.pack()
+
+    def extend(self, strings):
+        if isinstance(strings, Column):
+            # Share its blocks instead of copying the strings one by one
+            self.pack()
+            count = self.packed()
+            self.blocks.extend(strings.blocks)
+            self.ends.extend(strings.ends)
+            self.counts.extend(count + x for x in strings.counts)
+            strings = strings.tail
+        self.tail.extend(strings)
+        if len(self.tail) >= block_size:
+            self.pack()
+
+    def pack(self):
+        if not self.tail:
+            return
+        ends, total = None, 0
+        # Columns sources don't fill (e.g. 'pre' and 'post') are all empty
+        if any(imap(len, self.tail)):
+            ends = array('L')
+            append = ends.append
+            for string in self.tail:
+                total += len(string)
+                append(total)
+        self.blocks.append(''.join(self.tail))
+        self.ends.append(ends)
+        self.counts.append(len(self))
+        self.tail = []
+
+    def block_strings(self, b, start=0, stop=None):
+        ''' Strings start:stop of block b '''
+        first = self.counts[b - 1] if b else 0
+        stop = self.counts[b] - first if stop is None else stop
+        ends, block = self.ends[b], self.blocks[b]
+        if ends is None:
+            return [''] * (stop - start)
+        begins = ends[start - 1:stop - 1] if start else [0] + ends[:stop - 1].tolist()
+        return [block[i:j] for i, j in izip(begins, ends[start:stop])]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            strings = self.range(start, stop)
+            return strings if step == 1 else strings[::step]
+        if i < 0:
+            i += len(self)
+        packed = self.packed()
+        if i >= packed:
+            return self.tail[i - packed]
+        b = bisect_right(self.counts, i)
+        ends = self.ends[b]
+        if ends is None:
+            return ''
+        j = i - (self.counts[b - 1] if b else 0)
+        return self.blocks[b][ends[j - 1] if j else 0:ends[j]]
+
+    def range(self, start, stop):
+        strings = []
+        packed = self.packed()
+        b = bisect_right(self.counts, start)
+        while start < min(stop, packed):
+            first = self.counts[b - 1] if b else 0
+            end = min(stop, self.counts[b])
+            strings.extend(self.block_strings(b, start - first, end - first))
+            start, b = end, b + 1
+        if stop > packed:
+            strings.extend(self.tail[max(start, packed) - packed:stop - packed])
+        return strings
+
+    def __iter__(self):
+        for b in xrange(len(self.blocks)):
+            for string in self.block_strings(b):
+                yield string
+        for string in self.tail:
+            yield string
+
+    def chunks(self, start=0):
+        ''' (index of the first string, strings) of each block from 'start'
+        on, then of the strings not packed yet '''
+        packed = self.packed()
+        b = bisect_right(self.counts, start)
+        while start < packed:
+            first = self.counts[b - 1] if b else 0
+            yield start, self.block_strings(b, start - first)
+            start, b = self.counts[b], b + 1
+        if len(self) > start:
+            yield start, self.tail[start - packed:]
+
+
+class Candidates(object):
+    ''' Columnar list of candidates. Indexing and iterating give
+    variables.candidate instances, just like a plain list would '''
+
+    def __init__(self, candidates=()):
+        self.pre, self.filterable, self.post = Column(), Column(), Column()
+        self.extend(candidates)
+
+    @classmethod
+    def from_columns(cls, filterable, pre=None, post=None):
+        ''' Bulk constructor for sources which only have some of the fields '''
+        self = cls()
+        self.filterable.extend(filterable)
+        self.pre.extend(pre if pre is not None else [''] * len(filterable))
+        self.post.extend(post if post is not None else [''] * len(filterable))
+        return self
+
+    def __len__(self):
+        return len(self.filterable)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return map(candidate._make, izip(self.pre[i], self.filterable[i], self.post[i]))
+        return candidate._make((self.pre[i], self.filterable[i], self.post[i]))
+
+    def __iter__(self):
+        return imap(candidate._make, izip(self.pre, self.filterable, self.post))
+
+    def append(self, item):
+        self.pre.append(item.pre)
+        self.filterable.append(item.filterable)
+        self.post.append(item.post)
+
+    def extend(self, items):
+        if isinstance(items, Candidates):
+            self.pre.extend(items.pre)
+            self.filterable.extend(items.filterable)
+            self.post.extend(items.post)
+        else:
+            items = list(items)
+            self.pre.extend([x.pre for x in items])
+            self.filterable.extend([x.filterable for x in items])
+            self.post.extend([x.post for x in items])
+
+
+class Selection(object):
+    ''' Candidates at some indices of another list of candidates. They are
+    only fetched when read '''
+
+    def __init__(self, candidates, indices):
+        self.candidates = candidates
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.candidates[x] for x in self.indices[i]]
+        return self.candidates[self.indices[i]]
+
+    def __iter__(self):
+        return imap(self.candidates.__getitem__, self.indices)
+
+
+class Ranked(object):
+    ''' Candidates with a few of them moved to the front, in the order given
+    by 'top' (their positions in 'candidates'). The others keep their order '''
+
+    def __init__(self, candidates, top):
+        self.candidates = candidates
+        self.top = top
+        self.holes = sorted(top)
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def position(self, i):
+        ''' Position in 'candidates' of the i-th candidate after the top ones '''
+        for hole in self.holes:
+            if hole > i:
+                break
+            i += 1
+        return i
+
+    def range(self, start, stop):
+        candidates = [self.candidates[x] for x in self.top[start:stop]]
+        start, stop = max(0, start - len(self.top)), stop - len(self.top)
+        if start < stop:
+            first, last = self.position(start), self.position(stop - 1)
+            holes = set(self.holes)
+            candidates.extend(x for i, x in enumerate(self.candidates[first:last + 1], first) if i not in holes)
+        return candidates
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            candidates = self.range(start, stop)
+            return candidates if step == 1 else candidates[::step]
+        if i < 0:
+            i += len(self)
+        if i < len(self.top):
+            return self.candidates[self.top[i]]
+        return self.candidates[self.position(i - len(self.top))]
+
+    def __iter__(self):
+        holes = set(self.holes)
+        for i in self.top:
+            yield self.candidates[i]
+        for i, candidate in enumerate(self.candidates):
+            if i not in holes:
+                yield candidate
+
+
+# [candidate] -> Candidates
+def as_candidates(candidates):
+    return candidates if isinstance(candidates, Candidates) else Candidates(candidates)
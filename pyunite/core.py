@@ -1,15 +1,27 @@
+import os
 import re
 import vim
 import funcy as fn
-from importlib import import_module
 from uuid import uuid4 as uniqueid
-from itertools import ifilter, imap
+from bisect import bisect_left
+from itertools import ifilter, imap, izip, islice, takewhile
+from time import time
 from functools import partial
 from operator import itemgetter, contains
 from contextlib import contextmanager
-
-from . import variables, sources
-from .pure import *
+from collections import OrderedDict
+
+from . import variables, sources, matcher, streaming, cache, workers, profiling, view, frecency, snapshots
+from .unique import Uniques, candidate_keys, filterable_paths
+from .matcher import Matcher, Index, compile_positions, match_spans
+from .streaming import Stream
+from .candidates import Candidates, as_candidates
+from .batch import batched, command, flush
+from .actions import run_action
+from .diff import line_diff
+from .profiling import instrumented
+from .registry import source_signature
+from .helpers import *
 from .exceptions import *
 from .decorators import export
 
@@ -17,34 +29,98 @@ from .decorators import export
 @export()
 def start(cmdline):
     ''' Entry point '''
-    with exception_to_vim_errormsg():
+    with exception_to_vim_errormsg(), profiling.cprofiled():
         start_unite(fn.merge(variables.state, parse_state(cmdline)))
 
 
+# Sorted options and source names for command line completion, along with
+# the sources.generation they were built for
+completions = (None, [])
+
+
 @export()
 def complete_cmdline(arglead, cmdline, cursorpos):
     ''' Look at help for :command-completion-customlist '''
-    sources_and_options = list(fmt_options(variables.options.keys())) + sources.__all__
-    return filter(lambda x: x.startswith(arglead), sources_and_options)
+    global completions
+    if completions[0] != sources.generation:
+        table = sorted(list(fmt_options(variables.options.keys())) + sources.names)
+        completions = (sources.generation, table)
+    table = completions[1]
+    start = bisect_left(table, arglead)
+    return list(takewhile(lambda x: x.startswith(arglead), islice(table, start, None)))
+
+
+def snapshot_state(state):
+    ''' Keep what it takes to resume a state which is going away, unless its
+    candidates are still arriving. See snapshots.py '''
+    if state['buffer'] and not is_streaming(state):
+        cursor = vim.eval("get(get(getbufinfo({}), 0, {{}}), 'lnum', 1)".format(state['buffer'].number))
+        snapshots.take(source_signature(state), state, int(cursor))
+
+
+def resumed_sources(state):
+    ''' With -resume, take the sources, input, marks and cursor line of the
+    last state with the same sources instead of gathering candidates again.
+    Returns whether there was one to resume '''
+    snapshot = state['resume'] and snapshots.pop(source_signature(state))
+    if not snapshot:
+        return False
+    state.update(fn.project(snapshot, ['sources', 'input', 'offset', 'marked', 'cursor']))
+    state['uniques'] = snapshot['uniques'] if state['unique'] else None
+    return True
 
 
 def remove_state(state):
+    snapshot_state(state)
+    cancel_streams(state)
     state['buffer'].valid and delete_buffer(state['buffer'])
     variables.states.remove(state)
 
 
+# Whether states are removed on the events which close their buffer or
+# container (see set_state_autocommands) instead of on every WinEnter
+event_driven_sweeps = False
+
+
 @export()
 def win_enter():
-    ''' Remove invalid states
+    ''' Remove invalid states, unless Vim tells us when they become invalid.
     We have to do this on WinEnter because vim.windows hasn't been updated yet
     on WinLeave
     '''
-    map(remove_state, ifilter(invalid_state, variables.states))
+    if not event_driven_sweeps:
+        map(remove_state, ifilter(invalid_state, variables.states))
+
+
+@export()
+def on_buffer_wiped(number):
+    ''' BufWipeout of a PyUnite buffer: its state goes with it '''
+    state = variables.states.with_buffer(int(number))
+    if state:
+        snapshot_state(state)
+        cancel_streams(state)
+        variables.states.remove(state)
+
+
+@export()
+def sweep_states():
+    ''' Remove the states whose container (tabpage or window) was closed.
+    Only containers are checked, not every state '''
+    for container in variables.states.containers():
+        if not getattr(container, 'valid', True):
+            map(remove_state, variables.states.in_container(container))
+
+
+@export()
+def on_sweep_timer(timer):
+    ''' WinClosed fires before the window is gone, so sweep right after '''
+    sweep_states()
 
 
 @export()
 def vim_leave_pre():
     ''' Remove all pyunite states in each tabpage '''
+    frecency.save()
     with restore(vim.current.window), restore(vim.current.tabpage):
         states_by_tab = fn.group_by(itemgetter('tabpage_from'), variables.states)
         # error(str(dict(states_by_tab)))
@@ -53,6 +129,369 @@ def vim_leave_pre():
             map(remove_state, states)
 
 
+@export()
+def invalidate_cache(name):
+    ''' Forget the cached candidates of a source (see cache.py) '''
+    cache.invalidate(name)
+
+
+@export()
+def set_input(input):
+    ''' Filter the candidates of the PyUnite buffer in the current window '''
+    with exception_to_vim_errormsg():
+        state = current_state()
+        if state:
+            state['input'] = input
+            state['offset'] = 0
+            state['buffer'].vars['pyunite_input'] = input
+            update_filter(state, filter_sources)
+
+
+@export()
+def on_filter_timer(timer):
+    ''' Carry on with the filtering which didn't fit in the last keystroke '''
+    with exception_to_vim_errormsg():
+        for state in ifilter(lambda x: not filtering_done(x), variables.states):
+            update_filter(state, resume_filtering)
+        if all(imap(filtering_done, variables.states)):
+            vim.eval('timer_stop({})'.format(timer))
+            matcher.timer = None
+        vim.command('redraw')
+
+
+@export()
+def on_cmdline_changed():
+    ''' Filter as the user types in the prompt opened by set_buffer_mappings '''
+    if vim.eval('getcmdtype()') == '@':
+        set_input(vim.eval('getcmdline()'))
+        vim.command('redraw')
+
+
+@export()
+def on_stream_timer(timer):
+    ''' Show the candidates streamed since the last tick '''
+    with exception_to_vim_errormsg():
+        for state in ifilter(is_streaming, variables.states):
+            update_streamed(state)
+        if not any(imap(is_streaming, variables.states)):
+            vim.eval('timer_stop({})'.format(timer))
+            streaming.timer = None
+
+
+@export()
+def on_cursor_moved():
+    ''' Move the window of candidates held in the buffer along with the
+    cursor. See view.py '''
+    state = current_state()
+    if not state:
+        return
+    if len(state['view']) > view.window_size:
+        line, column = vim.current.window.cursor
+        index = view.candidate_index(state['offset'], line)
+        if view.near_edges(len(state['view']), state['offset'], index):
+            show_candidate(state, index, column)
+    if state['preview']:
+        preview_candidate(state)
+    highlight_matches(state)
+
+
+def preview_candidate(state):
+    ''' Run the preview action of the candidate under the cursor, if its
+    source has one. Files are read in the background, see preview.py '''
+    index = cursor_index(state)
+    if index is None:
+        return
+    position, candidate = state['view'].located(index)
+    module = source_module(state['sources'][position])
+    action = module.actions.get('preview')
+    if action:
+        with exception_to_vim_errormsg():
+            action(module.actionable_string(action, candidate))
+
+
+@export()
+def show_preview():
+    ''' Preview the candidate under the cursor. Unlike running an action,
+    it leaves the marks alone and PyUnite open '''
+    state = current_state()
+    if state:
+        preview_candidate(state)
+
+
+@export()
+def jump(index):
+    ''' Put the cursor on a candidate, a negative index counting from the end '''
+    state = current_state()
+    if state:
+        index = int(index)
+        show_candidate(state, index if index >= 0 else max(0, len(state['view']) + index))
+
+
+@export()
+def toggle_mark():
+    ''' Mark the candidate under the cursor, or unmark it, and move down '''
+    state = current_state()
+    index = state and cursor_index(state)
+    if index is None:
+        return
+    key = state['view'].located(index)
+    marked = OrderedDict(state['marked'])
+    if marked.pop(key, None) is None:
+        marked[key] = True
+    state['marked'] = marked
+    rerender(state)
+    line, column = vim.current.window.cursor
+    vim.current.window.cursor = (min(line + 1, len(state['lines'])), column)
+
+
+@export()
+def do_action(name):
+    ''' Run an action (the default one if 'name' is empty) on the marked
+    candidates, or on the one under the cursor. The candidates of each source
+    are given to its action all at once, see actions.run_action '''
+    with exception_to_vim_errormsg():
+        state = current_state()
+        index = state and cursor_index(state)
+        chosen = state and (state['marked'].keys() or ([state['view'].located(index)] if index is not None else []))
+        if not chosen:
+            return
+        by_source = fn.group_by(itemgetter(0), chosen)
+        window = vim.current.window
+        # Files are opened where PyUnite was started from
+        if state['window_from'] and state['window_from'].valid:
+            change_window(state['window_from'])
+        try:
+            for position in sorted(by_source):
+                module = source_module(state['sources'][position])
+                action = module.actions.get(name) if name else module.default_action
+                if action is None:
+                    raise PyUniteWarning('Source "{}" has no action "{}"'.format(state['sources'][position]['name'], name))
+                run_action(action, [module.actionable_string(action, x) for _, x in by_source[position]])
+        except (vim.error, PyUniteWarning) as e:
+            # Vim refused (e.g. E37, :edit abandoning a modified buffer): the
+            # candidates stay marked, for another try
+            if window.valid:
+                change_window(window)
+            (warn if isinstance(e, PyUniteWarning) else error)(str(e), store=True)
+            return
+        state['marked'] = OrderedDict()
+        if state['close_on_action']:
+            remove_state(state)
+            return
+        rerender(state)
+        # Actions opening tabpages leave us in them
+        if not state['leave_on_action'] and window.valid and window.tabpage == vim.current.tabpage:
+            change_window(window)
+
+
+def cursor_index(state):
+    ''' Index in the view of the candidate under the cursor. None when the
+    cursor is on a placeholder '''
+    index = view.candidate_index(state['offset'], vim.current.window.cursor[0])
+    shown = min(len(state['view']), state['offset'] + view.window_size)
+    return index if state['offset'] <= index < shown else None
+
+
+def show_candidate(state, index, column=0):
+    ''' Move the window around a candidate if needed and put the cursor on it '''
+    index = max(0, min(index, len(state['view']) - 1))
+    offset = view.centered_offset(len(state['view']), index)
+    if offset != state['offset']:
+        state['offset'] = offset
+        rerender(state)
+    vim.current.window.cursor = (view.buffer_line(offset, index), column)
+
+
+@instrumented(count=lambda positions, state: len(positions))
+def highlight_matches(state):
+    ''' Highlight where the input matched, with matchaddpos() rather than
+    syntax rules. Only the lines in sight (and a screenful on either side)
+    are looked at, and only again once the view, the input or those lines
+    change: the cost doesn't depend on the number of candidates. Matches
+    are window-local, so this waits for the buffer to be in the current
+    window '''
+    query = state['input'].strip()
+    if not state['buffer'] or not (query or state['highlighted']):
+        return []
+    flush()
+    if vim.current.buffer != state['buffer']:
+        return []
+    top, bottom = map(int, vim.eval("[line('w0'), line('w$')]"))
+    known = state['highlighted']
+    if known and known[:3] == (state['view'], state['offset'], query) and known[3] <= top and bottom <= known[4]:
+        return []
+    first, last = max(1, 2 * top - bottom - 1), min(len(state['lines']), 2 * bottom - top + 1)
+    positions = match_positions(state, compile_positions(query), first, last) if query else []
+    command('silent! call map(get(w:, "pyunite_matches", []), "matchdelete(v:val)")')
+    command('let w:pyunite_matches = [{}]'.format(', '.join(
+        "matchaddpos('pyuniteMatch', {})".format(positions[i:i + matches_per_call])
+        for i in xrange(0, len(positions), matches_per_call)
+    )))
+    state['highlighted'] = (state['view'], state['offset'], query, first, last) if query else None
+    return positions
+
+
+# Positions given to each matchaddpos(). Older Vims take up to 8
+matches_per_call = 8
+
+
+def match_positions(state, searches, first, last):
+    ''' [line, column, length] of the matched characters of the candidates
+    between two (1-based) lines of the buffer '''
+    positions = []
+    shown = min(len(state['view']), state['offset'] + view.window_size)
+    for line in xrange(first, last + 1):
+        index = view.candidate_index(state['offset'], line)
+        if not state['offset'] <= index < shown:
+            continue
+        position, candidate = state['view'].located(index)
+        column = filterable_column(state['sources'][position]['name'], candidate) + 1
+        positions.extend([line, column + start, length] for start, length in match_spans(searches, candidate.filterable))
+    return positions
+
+
+@export()
+def profile(args):
+    ''' :PyUniteProfile [on|off|clear|cprofile|dump {file}]. Without arguments
+    the report is shown in a new window. See profiling.py '''
+    with exception_to_vim_errormsg():
+        words = args.split(None, 1) or ['report']
+        if words[0] == 'on':
+            profiling.enable()
+        elif words[0] == 'off':
+            profiling.disable()
+        elif words[0] == 'clear':
+            profiling.clear()
+        elif words[0] == 'cprofile':
+            profiling.capture = True
+        elif words[0] == 'dump' and len(words) == 2:
+            profiling.dump(os.path.expanduser(words[1]))
+        elif words[0] == 'report':
+            if not profiling.records and not profiling.captured:
+                raise PyUniteWarning('Nothing was profiled. Use :PyUniteProfile on')
+            buff = make_window(buffer_name='pyunite-profile').buffer
+            with batched():
+                set_buffer_option(buff, 'buftype', 'nofile')
+                set_buffer_option(buff, 'bufhidden', 'wipe')
+                set_buffer_option(buff, 'swapfile', False)
+            buff[:] = profiling.report(profiling.records)
+        else:
+            raise PyUniteWarning('Usage: PyUniteProfile [on|off|clear|cprofile|dump {file}]')
+
+
+vim.command('command! -nargs=? PyUniteProfile call s:{}(<q-args>)'.format(profile.func_name))
+
+
+def cancel_streams(state):
+    for stream in icompact(fn.pluck('stream', state['sources'])):
+        stream.cancel()
+
+
+def start_stream_timer():
+    if streaming.timer is None:
+        streaming.timer = int(vim.eval("timer_start({}, function('s:{}'), {{'repeat': -1}})".format(
+            streaming.interval,
+            on_stream_timer.func_name,
+        )))
+
+
+def update_streamed(state):
+    ''' Move the candidates which have arrived into their sources and show
+    them. Only the window of candidates held in the buffer is rewritten '''
+    buff = state['buffer']
+    changed = False
+    for source in state['sources']:
+        old_count = len(source['candidates'])
+        source['stream'] and source['stream'].flush()
+        if len(source['candidates']) > old_count:
+            rank_source(state, source)
+            changed = True
+    changed and unique_sources(state)
+    if changed and state['input'].strip():
+        update_filter(state, filter_sources)
+    elif changed:
+        rerender(state)
+    for source in ifilter(lambda x: x['stream'] and x['stream'].done, state['sources']):
+        if source['stream'].error:
+            warn('Source "{}" failed: {}'.format(source['name'], source['stream'].error))
+        elif not source['stream'].cancelled:
+            # Cut short: its candidates aren't all there
+            cache_source(source)
+        source['stream'] = None
+        changed = True
+    changed and rename_buffer(buff, make_buffer_name(state))
+
+
+def current_state():
+    ''' State of the PyUnite buffer in the current window, if any '''
+    return variables.states.get(vim.current.buffer.vars.get('pyunite_uid'))
+
+
+def filter_sources(state, deadline=None):
+    ''' Start matching the candidates of each source against the state's
+    input. Returns True when done, False if the deadline was hit '''
+    for source in state['sources']:
+        source['matcher'] = source['matcher'] or Matcher(Index(source['candidates']))
+        source['matcher'].filter(state['input'], deadline)
+    return filtering_done(state)
+
+
+def resume_filtering(state, deadline=None):
+    for source in state['sources']:
+        source['matcher'].resume(deadline)
+    return filtering_done(state)
+
+
+def filtering_done(state):
+    return all(not x['matcher'] or x['matcher'].done for x in state['sources'])
+
+
+def update_filter(state, step):
+    ''' Run one filtering step within the frame budget and show its results.
+    If that wasn't enough, the rest is done from a timer so Vim stays
+    responsive. Partial results aren't shown: rendering them on every step
+    would cost more than the filtering itself '''
+    timers = vhas('timers')
+    done = step(state, time() + matcher.frame_budget if timers else None)
+    if done:
+        rerender(state)
+    else:
+        start_filter_timer()
+
+
+def start_filter_timer():
+    ''' One timer resumes the filtering of every state, however many
+    keystrokes and states are waiting for it '''
+    if matcher.timer is None:
+        matcher.timer = int(vim.eval("timer_start(0, function('s:{}'), {{'repeat': -1}})".format(
+            on_filter_timer.func_name,
+        )))
+
+
+def cache_source(source):
+    ''' Share the candidates (and their index) of a source with future
+    states. Sources may ask for the cache to be invalidated on Vim events '''
+    module = source_module(source)
+    source['matcher'] = source['matcher'] or Matcher(Index(source['candidates']))
+    cache.put(source, source['matcher'].index, getattr(module, 'cache_ttl', cache.default_ttl))
+    events = getattr(module, 'cache_invalidated_by', [])
+    if events and source['name'] not in cache.hooked:
+        with batched():
+            command('augroup plugin-pyunite-cache')
+            command('autocmd {} * call s:{}("{}")'.format(
+                ','.join(events),
+                invalidate_cache.func_name,
+                source['name'],
+            ))
+            command('augroup END')
+        cache.hooked.add(source['name'])
+
+
+def copied_sources(sources):
+    ''' Sources sharing candidates (and their index) but not their filter '''
+    return map(lambda x: fn.merge(x, dict(matcher=x['matcher'] and Matcher(x['matcher'].index))), sources)
+
+
 @contextmanager
 def exception_to_vim_errormsg():
     try:
@@ -125,26 +564,27 @@ error = partial(echo, high='ErrorMsg')
 
 
 def change_tabpage(tabpage, autocmd=False):
-    vim.command('silent {} tabnext {}'.format('' if autocmd else 'noautocmd', tabpage.number))
+    command('silent {} tabnext {}'.format('' if autocmd else 'noautocmd', tabpage.number))
 
 
 def make_window(direction='', vsplit=False, size=0, buffer_name='', autocmd=False):
-    vim.command('silent {} {} {}{} {}'.format(
+    command('silent {} {} {}{} {}'.format(
         '' if autocmd else 'noautocmd',
         direction,
         str(size) if size > 0 else '',
         'vnew' if vsplit else 'new',
         escape(' ', buffer_name),
     ))
+    flush()
     return vim.current.window
 
 
 def change_window(window, autocmd=False):
-    vim.command('silent {} {}wincmd w'.format('' if autocmd else 'noautocmd', window.number))
+    command('silent {} {}wincmd w'.format('' if autocmd else 'noautocmd', window.number))
 
 
 def resize_window(size, vsplit=False, autocmd=False):
-    vim.command('silent {} {} resize {}'.format(
+    command('silent {} {} resize {}'.format(
         '' if autocmd else 'noautocmd',
         'vertical' if vsplit else '',
         size
@@ -152,20 +592,45 @@ def resize_window(size, vsplit=False, autocmd=False):
 
 
 def quit_window(autocmd=False):
-    vim.command('silent {} close!'.format('' if autocmd else 'noautocmd'))
+    command('silent {} close!'.format('' if autocmd else 'noautocmd'))
+    flush()
 
 
 def make_buffer(name, autocmd=False):
-    vim.command('silent {} edit {}'.format('' if autocmd else 'noautocmd', escape(' ', name)))
+    command('silent {} edit {}'.format('' if autocmd else 'noautocmd', escape(' ', name)))
+    flush()
     return vim.current.buffer
 
 
 def change_buffer(buff, autocmd=False):
-    vim.command('silent {} {}buffer'.format('' if autocmd else 'noautocmd', buff.number))
+    command('silent {} {}buffer'.format('' if autocmd else 'noautocmd', buff.number))
 
 
 def delete_buffer(buff, autocmd=False):
-    vim.command('silent {} bdelete! {}'.format('' if autocmd else 'noautocmd', buff.number))
+    command('silent {} bdelete! {}'.format('' if autocmd else 'noautocmd', buff.number))
+
+
+def rename_buffer(buff, name):
+    ''' Renaming leaves behind an unlisted buffer with the old name (:h
+    :file_f). Wipe it '''
+    old_name = buff.name
+    buff.name = name
+    stale = find(lambda x: x.name == old_name and x.number != buff.number, vim.buffers)
+    stale and vim.command('silent! noautocmd bwipeout {}'.format(stale.number))
+
+
+def set_buffer_option(buff, name, value):
+    command("call setbufvar({}, '&{}', {})".format(buff.number, name, vim_literal(value)))
+
+
+def set_window_option(window, name, value, silent=False):
+    ''' Use 'silent' for options which depend on compile time features '''
+    command("{}call setwinvar({}, '&{}', {})".format(
+        'silent! ' if silent else '',
+        window.number,
+        name,
+        vim_literal(value),
+    ))
 
 
 def vhas(option):
@@ -177,7 +642,7 @@ def vexists(option):
 
 
 def source_module(source):
-    return import_module('pyunite.sources.' + source['name'])
+    return sources.get(source['name'])
 
 
 def command_output(command):
@@ -192,11 +657,12 @@ def window_with_buffer(buff, windows=None):
 
 
 handlers = dict(
+    CmdlineChanged = on_cmdline_changed,
+    CursorMoved = on_cursor_moved,
     # InsertEnter   = export()(on_insert_enter),
     # InsertLeave   = export()(on_insert_leave),
     # CursorHoldI   = export()(on_cursor_hold_i),
     # CursorMovedI  = export()(on_cursor_moved_i),
-    # CursorMoved   = export()(on_cursor_moved),
     # CursorMovedI  = export()(on_cursor_moved),
     # BufHidden     = export()(on_buf_unload),
     # BufUnload     = export()(on_buf_unload),
@@ -207,40 +673,82 @@ handlers = dict(
 
 
 def set_buffer_autocommands(buff):
-    vim.command('augroup plugin-pyunite')
-    vim.command('autocmd! * <buffer={}>'.format(buff.number))
-    for event, handler in handlers:
-        vim.command('autocmd {} <buffer={}> call s:{}()'.format(
-            event,
+    ''' Events this Vim doesn't have (e.g. CmdlineChanged before 8.1) are
+    left out '''
+    events = [x for x in handlers.items() if vexists('##' + x[0])]
+    with batched():
+        command('augroup plugin-pyunite')
+        command('autocmd! * <buffer={}>'.format(buff.number))
+        for event, handler in events:
+            command('autocmd {} <buffer={}> call s:{}()'.format(
+                event,
+                buff.number,
+                handler.func_name,
+            ))
+        command('autocmd BufWipeout <buffer={0}> call s:{1}({0})'.format(
             buff.number,
-            handler.func_name,
+            on_buffer_wiped.func_name,
         ))
-    vim.command('augroup END')
+        command('augroup END')
 
 
-def set_buffer_options(buff):
-    buff.options['bufhidden'] = 'wipe'
-    buff.options['buflisted'] = False
-    buff.options['buftype'] = 'nofile'
-    buff.options['completefunc'] = ''
-    buff.options['omnifunc'] = ''
-    buff.options['iskeyword'] += ',-,+,\\,!,~'
-    buff.options['matchpairs'] = re.sub('<:>,', '', buff.options['matchpairs'])
-    buff.options['modeline'] = False
-    buff.options['modifiable'] = False
-    buff.options['readonly'] = False
-    buff.options['swapfile'] = False
-    buff.options['filetype'] = 'pyunite'
+def set_state_autocommands():
+    ''' Sweep states when tabpages and windows are closed, if this Vim has
+    the events for it. Otherwise win_enter does it '''
+    global event_driven_sweeps
+    event_driven_sweeps = vexists('##WinClosed') and vexists('##TabClosed') and vhas('timers')
+    if event_driven_sweeps:
+        with batched():
+            command('augroup plugin-pyunite-states')
+            command('autocmd!')
+            command('autocmd TabClosed * call s:{}()'.format(sweep_states.func_name))
+            command("autocmd WinClosed * call timer_start(0, function('s:{}'))".format(on_sweep_timer.func_name))
+            command('augroup END')
 
 
-def set_buffer_mappings(buff):
-    pass
+def set_buffer_options(buff):
+    with batched():
+        set_buffer_option(buff, 'bufhidden', 'wipe')
+        set_buffer_option(buff, 'buflisted', False)
+        set_buffer_option(buff, 'buftype', 'nofile')
+        set_buffer_option(buff, 'completefunc', '')
+        set_buffer_option(buff, 'omnifunc', '')
+        # Computed on Vim's side so that the current values needn't be read
+        command("call setbufvar({0}, '&iskeyword', getbufvar({0}, '&iskeyword') . ',-,+,\\,!,~')".format(buff.number))
+        command("call setbufvar({0}, '&matchpairs', substitute(getbufvar({0}, '&matchpairs'), '<:>,', '', 'g'))".format(buff.number))
+        set_buffer_option(buff, 'modeline', False)
+        set_buffer_option(buff, 'modifiable', False)
+        set_buffer_option(buff, 'readonly', False)
+        set_buffer_option(buff, 'swapfile', False)
+        set_buffer_option(buff, 'undolevels', -1)
+        set_buffer_option(buff, 'filetype', 'pyunite')
 
 
-def set_buffer_contents(buff, contents):
+def set_buffer_mappings(buff):
+    ''' Buffer-local mappings are set on the current buffer '''
+    command('nnoremap <silent> <buffer> i :<C-u>call s:{}(input("> ", b:pyunite_input))<CR>'.format(
+        set_input.func_name,
+    ))
+    # The buffer may only hold some of the candidates
+    command('nnoremap <silent> <buffer> gg :<C-u>call s:{}(v:count1 - 1)<CR>'.format(jump.func_name))
+    command('nnoremap <silent> <buffer> G :<C-u>call s:{}(v:count ? v:count - 1 : -1)<CR>'.format(jump.func_name))
+    command('nnoremap <silent> <buffer> <Space> :<C-u>call s:{}()<CR>'.format(toggle_mark.func_name))
+    command('nnoremap <silent> <buffer> <CR> :<C-u>call s:{}("")<CR>'.format(do_action.func_name))
+    command('nnoremap <silent> <buffer> p :<C-u>call s:{}()<CR>'.format(show_preview.func_name))
+
+
+@instrumented(count=lambda _, buff, contents, old_contents=None: len(contents))
+def set_buffer_contents(buff, contents, old_contents=None):
+    ''' Only write the lines which changed. 'old_contents' is what the buffer
+    is believed to hold; it's read from the buffer when that's not known or
+    doesn't add up '''
+    new = list(contents) or ['']
+    old = old_contents or ['']
+    if old_contents is None or len(old) != len(buff):
+        old = buff[:]
     with scoped(buff.options, modifiable=True):
-        buff[:] = None
-        buff.append(list(contents), 0)
+        for start, stop, lines in reversed(line_diff(old, new)):
+            buff[start:stop] = lines
 
 
 def get_included_syntax_name(syntaxes):
@@ -251,62 +759,85 @@ def get_included_syntax_name(syntaxes):
     return fn.first(fn.keep(imap(get_it, syntaxes)))
 
 
+@fn.memoize
+def source_syntax(name):
+    ''' Syntax and highlight commands of a source '''
+    module = source_module(dict(name=name))
+    syntaxes = module.syntaxes()
+    included_syntax = get_included_syntax_name(syntaxes)
+    what_makes_the_magic_happen = [
+        'syntax match {source}_source_name /^{source}/ contained',
+        'syntax region {source} oneline keepend start=/^{source}/ end=/$/ contains=' + (included_syntax or '') + ',{source}_.*',
+        'highlight default link {source}_source_name Comment',
+    ]
+    return map(
+        lambda cmd: cmd.format(source=name),
+        syntaxes + module.highlights() + what_makes_the_magic_happen
+    )
+
+
+@fn.memoize
+def compiled_syntax(names):
+    ''' All the syntax commands for a combination of sources, as one block '''
+    return '\n'.join(
+        ['syntax clear'] +
+        list(fn.iflatten(imap(source_syntax, names))) +
+        ['syntax match pyuniteMore /^-- .* more --$/', 'highlight default link pyuniteMore Comment'] +
+        ['highlight default link pyuniteMatch Search'] +
+        ['syntax sync minlines=1 maxlines=1']
+    )
+
+
+@instrumented()
 def set_buffer_syntax(state):
-    vim.command('syntax clear')
-    for source in state['sources']:
-        module = source_module(source)
-        included_syntax = get_included_syntax_name(module.syntaxes())
-        what_makes_the_magic_happen = [
-            'syntax match {source}_source_name /^{source}/ contained',
-            'syntax region {source} oneline keepend start=/^{source}/ end=/$/ contains=' + (included_syntax or '') + ',{source}_.*',
-            'highlight default link {source}_source_name Comment',
-        ]
-        map(
-            lambda cmd: vim.command(cmd.format(source=source['name'])),
-            module.syntaxes() + module.highlights() + what_makes_the_magic_happen
-        )
-    vim.command('syntax sync minlines=1 maxlines=1')
+    ''' Syntax is buffer-local, so there's nothing to do when the buffer
+    already has the syntax of these sources (e.g. when it's being reused) '''
+    names = tuple(fn.pluck('name', state['sources']))
+    signature = ' '.join(names)
+    if state['buffer'].vars.get('pyunite_syntax') == signature:
+        return
+    command(compiled_syntax(names))
+    state['buffer'].vars['pyunite_syntax'] = signature
 
 
 def make_buffer_name(state):
-    return '{}{} pyunite:{} ({})'.format(
+    return '{}{} pyunite:{} ({}{})'.format(
         '' if state['replace'] else '[NR] ',
         state['scope'][:3].upper(),
-        str(uniqueid())[:7],
-        len(list(aggregate_candidates(state))),
+        state['uid'][:7],
+        len(state['view']),
+        '...' if is_streaming(state) else '',
     )
 
 
 def make_pyunite_buffer(state, autocmd=False):
-    with restore(vim.current.buffer):
-        buff = make_buffer(make_buffer_name(state))
-    buff.vars['pyunite_uid'] = state['uid']
-    set_buffer_options(buff)
-    set_buffer_autocommands(buff)
-    set_buffer_mappings(buff)
-    set_buffer_contents(buff, aggregate_candidates(state))
+    with batched():
+        with restore(vim.current.buffer):
+            buff = make_buffer(make_buffer_name(state))
+            set_buffer_mappings(buff)
+        buff.vars['pyunite_uid'] = state['uid']
+        buff.vars['pyunite_input'] = state['input']
+        set_buffer_options(buff)
+        set_buffer_autocommands(buff)
+    set_buffer_contents(buff, state['lines'])
     return buff
 
 
 def set_window_options(window):
-    if vhas('cursorbind'):
-        window.options['cursorbind'] = False
-    if vhas('conceal'):
-        window.options['conceallevel'] = 3
-        window.options['concealcursor'] = 'niv'
-    if vexists('+cursorcolumn'):
-        window.options['cursorcolumn'] = False
-    if vexists('+colorcolumn'):
-        window.options['colorcolumn'] = ''
-    if vexists('+relativenumber'):
-        window.options['relativenumber'] = False
-    window.options['cursorline'] = False
-    window.options['foldcolumn'] = 0
-    window.options['foldenable'] = False
-    window.options['list'] = False
-    window.options['number'] = False
-    window.options['scrollbind'] = False
-    window.options['spell'] = False
+    with batched():
+        set_window_option(window, 'cursorbind', False, silent=True)
+        set_window_option(window, 'conceallevel', 3, silent=True)
+        set_window_option(window, 'concealcursor', 'niv', silent=True)
+        set_window_option(window, 'cursorcolumn', False, silent=True)
+        set_window_option(window, 'colorcolumn', '', silent=True)
+        set_window_option(window, 'relativenumber', False, silent=True)
+        set_window_option(window, 'cursorline', False)
+        set_window_option(window, 'foldcolumn', 0)
+        set_window_option(window, 'foldenable', False)
+        set_window_option(window, 'list', False)
+        set_window_option(window, 'number', False)
+        set_window_option(window, 'scrollbind', False)
+        set_window_option(window, 'spell', False)
 
 
 def make_pyunite_window(state, autocmd=False):
@@ -321,12 +852,95 @@ def make_pyunite_window(state, autocmd=False):
     return window
 
 
+def render(state):
+    ''' Format the window of (filtered) candidates held in the buffer of a
+    state. This is the only place where they should be formatted '''
+    with profiling.phase('aggregate_candidates') as record:
+        state['view'] = aggregate_candidates(state)
+        state['offset'] = view.clamped_offset(len(state['view']), state['offset'])
+        state['lines'] = view.window_lines(state['view'], state['offset'])
+        record['candidates'] = len(state['view'])
+    return state['lines']
+
+
+def rerender(state, old_lines=None):
+    ''' Render a state again and write what changed to its buffer '''
+    old_lines = state['lines'] if old_lines is None else old_lines
+    set_buffer_contents(state['buffer'], render(state), old_lines)
+    highlight_matches(state)
+
+
+def gathered_candidates(source):
+    return as_candidates(source_module(source).get_candidates(*source['args']))
+
+
+@instrumented(count=lambda sources, state: sum(len(x['candidates']) for x in sources))
 def populated_candidates(state):
+    can_stream = vhas('timers')
+    gathered = []
     for source in state['sources']:
-        source['candidates'] = source_module(source).get_candidates(*source['args'])
+        module = source_module(source)
+        # An index is empty until the candidates are first filtered: test
+        # for None, not truthiness
+        index = cache.get(source) if state['cache'] else None
+        if index is not None:
+            source['candidates'] = index.candidates
+            source['matcher'] = Matcher(index)
+        elif can_stream and hasattr(module, 'stream_candidates'):
+            source['candidates'] = Candidates()
+            source['stream'] = Stream(module.stream_candidates(*source['args']), source['candidates'])
+        else:
+            gathered.append(source)
+
+    # Sources declared thread safe are gathered concurrently while the ones
+    # using the vim module run on the main thread
+    is_thread_safe = lambda x: getattr(source_module(x), 'thread_safe', False)
+    threaded = filter(is_thread_safe, gathered)
+    results = workers.map_async(gathered_candidates, threaded)
+    for source in ifilter(lambda x: not is_thread_safe(x), gathered):
+        source['candidates'] = gathered_candidates(source)
+    for source, candidates in izip(threaded, results.get()):
+        source['candidates'] = candidates
+    map(cache_source, gathered)
+
+    # Don't open an empty window if the first chunks are about to arrive
+    deadline = time() + streaming.first_chunk_timeout
+    for stream in icompact(fn.pluck('stream', state['sources'])):
+        stream.wait(max(0, deadline - time()))
+        stream.flush()
+    return state['sources']
+
+
+@instrumented(count=lambda sources, state: sum(len(x['ranking']) for x in sources))
+def ranked_sources(state):
+    ''' Sorter stage: find the candidates actions ran on before, so that
+    they're shown first. Candidates are looked up by their filterable string,
+    which is what the built-in sources run actions on '''
+    for source in state['sources']:
+        rank_source(state, source)
+    return state['sources']
+
+
+@instrumented(count=lambda sources, state: sum(len(x) for x in state['uniques'].hidden) if state['uniques'] else 0)
+def unique_sources(state):
+    ''' Dedup stage: hide the candidates with the same key as one seen before,
+    in this source or in one listed before it. Only the candidates which
+    arrived since the last time are looked at. See unique.py '''
+    if state['unique']:
+        if not state['uniques']:
+            cwd = os.getcwd()
+            keys = [getattr(source_module(x), 'unique_key', None) for x in state['sources']]
+            state['uniques'] = Uniques([candidate_keys(x) if x else filterable_paths(cwd) for x in keys])
+        state['uniques'].update(state['sources'])
     return state['sources']
 
 
+def rank_source(state, source):
+    if state['frecency']:
+        source['ranking'] = frecency.ranking(source['candidates'].filterable)
+
+
+@instrumented()
 def window_logic(state, old_state):
     '''
     Window create/resize logic. The function name is not very good :(
@@ -362,15 +976,18 @@ def window_logic(state, old_state):
 
     else:
         change_window(old_window)
+        flush()
         # If bufhidden=wipe, buffer will dissapear when we close its window
         with restore(vim.current.window), scoped(state['buffer'].options, bufhidden='hide'):
             quit_window()
         window = make_pyunite_window(state, autocmd=True)
 
+    flush()
     state['size'] = window.width if state['vsplit'] else window.height
     return window
 
 
+@instrumented(count=lambda _, state: len(state['view']))
 def buffer_logic(state):
     '''
     Buffer create/replace/reuse logic. The function name is not very good :(
@@ -396,42 +1013,66 @@ def buffer_logic(state):
     '''
     # We are only interested in buffers which are in the same container.
     # That's where the interesting reuse/replace logic is at.
-    states = fn.where(variables.states, container=state['container'])
+    signature = source_signature(state)
+    states = variables.states.in_container(state['container'])
+    with_same_sources = variables.states.with_sources(state['container'], signature)
 
-    with_same_sources = partial(same_sources, state)
+    reusable_state = fn.first(fn.where(with_same_sources, replace=state['replace']))
 
-    reusable_state = fn.first(fn.where(
-        ifilter(with_same_sources, states),
-        replace = state['replace']
-    ))
-
-    replaceable_state = fn.first(fn.where(
-        ifilter(lambda x: not with_same_sources(x), states),
-        replace = True
-    ))
+    replaceable_state = find(lambda x: x['replace'] and source_signature(x) != signature, states)
 
     old_state = None
 
     if reusable_state:
-        state.update(fn.project(reusable_state, ['uid', 'buffer', 'sources']))
+        state.update(fn.project(reusable_state, ['uid', 'buffer', 'sources', 'view', 'offset', 'lines', 'marked']))
+        if state['resume']:
+            state['input'] = reusable_state['input']
+        state['uniques'] = reusable_state['uniques'] if state['unique'] else None
+        unique_sources(state)
+        if state['input'] != reusable_state['input']:
+            filter_sources(state)
+            state['offset'] = 0
+            rerender(state)
+            state['buffer'].vars['pyunite_input'] = state['input']
+        elif state['unique'] != reusable_state['unique']:
+            rerender(state)
         old_state = reusable_state
         variables.states.remove(reusable_state)
 
     elif replaceable_state:
         state.update(fn.project(replaceable_state, ['uid', 'buffer']))
-        state['sources'] = populated_candidates(state)
-        set_buffer_contents(state['buffer'], aggregate_candidates(state))
+        snapshot_state(replaceable_state)
+        cancel_streams(replaceable_state)
+        if not resumed_sources(state):
+            state['sources'] = populated_candidates(state)
+        unique_sources(state)
+        ranked_sources(state)
+        filter_sources(state)
+        rerender(state, replaceable_state['lines'])
+        state['buffer'].vars['pyunite_input'] = state['input']
         old_state = replaceable_state
         variables.states.remove(replaceable_state)
 
     else:
-        same = find(with_same_sources, states)
-        state['sources'] = (same and same['sources']) or populated_candidates(state)
+        # Streamed candidates are only shown in the buffer which asked for them
+        same = find(lambda x: not is_streaming(x), with_same_sources)
+        if resumed_sources(state):
+            unique_sources(state)
+        elif same:
+            state['sources'] = copied_sources(same['sources'])
+            unique_sources(state)
+        else:
+            state['sources'] = populated_candidates(state)
+            unique_sources(state)
+            ranked_sources(state)
+        filter_sources(state)
+        render(state)
         state['buffer'] = make_pyunite_buffer(state)
 
     return old_state
 
 
+@instrumented(count=lambda _, state: len(state['view']))
 def start_unite(state):
     validate_state(state)
     state['uid'] = str(uniqueid())
@@ -443,11 +1084,21 @@ def start_unite(state):
         'window': vim.current.window
     }[state['scope']]
     old_state = buffer_logic(state)
-    if state['close_on_empty'] and len(list(aggregate_candidates(state))) == 0:
+    if state['close_on_empty'] and not is_streaming(state) and not state['view']:
         return
     saved = vim.current.window
-    window_logic(state, old_state)
-    set_buffer_syntax(state)
-    if not state['focus_on_open']:
-        change_window(saved, autocmd=True)
-    variables.states.append(state)
+    with batched():
+        window_logic(state, old_state)
+        set_buffer_syntax(state)
+        if state['cursor']:
+            vim.current.window.cursor = (min(state['cursor'], len(state['lines'])), 0)
+            state['cursor'] = None
+        highlight_matches(state)
+        if not state['focus_on_open']:
+            change_window(saved, autocmd=True)
+    variables.states.add(state)
+    if is_streaming(state):
+        start_stream_timer()
+
+
+set_state_autocommands()
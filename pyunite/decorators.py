@@ -1,8 +1,13 @@
+import sys
 import vim
+import __main__
 
 
 functions = {}
 
+# Vim function evaluating a Python expression with the running interpreter
+pyeval = 'pyeval' if sys.version_info[0] == 2 else 'py3eval'
+
 
 def vim_cast(value):
     if value is None:
@@ -17,7 +22,37 @@ def vim_cast(value):
         return str(value)
 
 
-def export(scope='local'):
+def marshal(value):
+    ''' Turn a return value into something pyeval() can convert to a Vim
+    value: None and booleans become numbers, other iterables lists '''
+    if value is None:
+        return 0
+    elif isinstance(value, bool):
+        return int(value)
+    elif isinstance(value, (str, unicode, int, long, float, dict)):
+        return value
+    else:
+        return map(marshal, value)
+
+
+def dispatch(name, args_expression):
+    ''' Trampoline called by exported functions: all the arguments are
+    fetched with a single vim.eval() '''
+    args = vim.eval(args_expression) if args_expression else []
+    return marshal(functions[name](*args))
+
+
+# pyeval() evaluates expressions in the __main__ module
+__main__._pyunite_dispatch = dispatch
+
+
+def export(scope='local', fast=True):
+    ''' Define a Vim function calling the decorated Python function.
+
+    With 'fast' the Vim function is a one-line pyeval() of the trampoline
+    above. Otherwise its body is a 'python << EOF' block, which has to be
+    compiled on every call and fetches each argument separately.
+    '''
     def wrapper(wrapped):
         global functions
 
@@ -36,14 +71,20 @@ def export(scope='local'):
 
         code = []
         code.append('function! ' + vim_name + '(' + args_string + ')')
-        code.append('python << EOF')
-        code.append('from pyunite.decorators import functions, vim_cast')
 
-        eval_arg_commands = map(lambda x: 'vim.eval("a:{}")'.format(x), args_names)
-        retvalue_string = 'vim_cast(functions["' + name + '"](' + ', '.join(eval_arg_commands) + '))'
+        if fast:
+            args_expression = '[' + ', '.join(map(lambda x: 'a:' + x, args_names)) + ']' if args_names else ''
+            code.append("return {}('_pyunite_dispatch(\"{}\", \"{}\")')".format(pyeval, name, args_expression))
+        else:
+            code.append('python << EOF')
+            code.append('from pyunite.decorators import functions, vim_cast')
+
+            eval_arg_commands = map(lambda x: 'vim.eval("a:{}")'.format(x), args_names)
+            retvalue_string = 'vim_cast(functions["' + name + '"](' + ', '.join(eval_arg_commands) + '))'
+
+            code.append('vim.command("return " + ' + retvalue_string + ')')
+            code.append('EOF')
 
-        code.append('vim.command("return " + ' + retvalue_string + ')')
-        code.append('EOF')
         code.append('endfunction')
         vim.command('\n'.join(code))
 
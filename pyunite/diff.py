@@ -0,0 +1,86 @@
+''' Line-level diffs used to update buffers with as few writes as possible.
+
+A diff is a list of (start, stop, lines) replacements to apply to the old
+lines, sorted by position and not overlapping. Applying them from the last one
+backwards keeps the positions of the remaining ones valid.
+'''
+from difflib import SequenceMatcher
+
+
+# Middle sections (what's left after trimming the common prefix and suffix)
+# longer than this are not diffed any further, just replaced
+max_diffed_lines = 20000
+
+# Diffs with more replacements than this are merged into a single one. Each
+# replacement is a separate write to the buffer
+max_replacements = 64
+
+
+# [a] -> [a] -> int
+def common_prefix_length(old, new):
+    ''' Binary search comparing slices, so that comparisons run in C '''
+    low, high = 0, min(len(old), len(new))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if old[low:middle] == new[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+# [a] -> [a] -> int -> int
+def common_suffix_length(old, new, prefix):
+    low, high = 0, min(len(old), len(new)) - prefix
+    while low < high:
+        middle = (low + high + 1) // 2
+        if old[len(old) - middle:len(old) - low] == new[len(new) - middle:len(new) - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+# [a] -> [a] -> [(int, int)] or None
+def deletions(old, new):
+    ''' Ranges of old to delete if new is old with some lines removed (what
+    happens when a filter gets narrower). None otherwise '''
+    ranges, i = [], 0
+    for line in new:
+        start = i
+        while i < len(old) and old[i] != line:
+            i += 1
+        if i == len(old):
+            return None
+        if i > start:
+            ranges.append((start, i))
+        i += 1
+    if i < len(old):
+        ranges.append((i, len(old)))
+    return ranges
+
+
+# [str] -> [str] -> [(int, int, [str])]
+def line_diff(old, new):
+    prefix = common_prefix_length(old, new)
+    suffix = common_suffix_length(old, new, prefix)
+    old_middle = old[prefix:len(old) - suffix]
+    new_middle = new[prefix:len(new) - suffix]
+    if not old_middle and not new_middle:
+        return []
+
+    if len(old_middle) + len(new_middle) > max_diffed_lines:
+        removed = deletions(old_middle, new_middle) if len(new_middle) < len(old_middle) else None
+        if removed is None:
+            return [(prefix, prefix + len(old_middle), new_middle)]
+        replacements = [(prefix + i, prefix + j, []) for i, j in removed]
+    else:
+        opcodes = SequenceMatcher(None, old_middle, new_middle, autojunk=False).get_opcodes()
+        replacements = [
+            (prefix + i1, prefix + i2, new_middle[j1:j2])
+            for tag, i1, i2, j1, j2 in opcodes if tag != 'equal'
+        ]
+
+    if len(replacements) > max_replacements:
+        return [(prefix, prefix + len(old_middle), new_middle)]
+    return replacements
@@ -0,0 +1,143 @@
+''' Frecency of the strings actions ran on, to show those candidates first.
+
+Every visit of a string counts 2 ** (time / half_life), so each one weighs half
+as much after 'half_life' seconds. Only the base 2 logarithm of the sum is
+kept: one float per string, and strings are ranked by comparing those floats
+without ever looking at the clock.
+
+The store is loaded the first time a score is needed. Visits are queued and
+only written once 'batch_size' of them have accumulated (or when Vim exits),
+merging them into whatever other Vim instances wrote in the meantime. On disk,
+it's the strings joined by NULs and an array of doubles.
+'''
+import math
+import marshal
+from array import array
+from itertools import compress, count, imap
+from time import time
+from weakref import WeakKeyDictionary
+
+from .storage import cache_path, atomic_marshal_dump
+
+
+# Seconds for the weight of a visit to halve
+half_life = 3 * 24 * 3600
+
+# Max number of strings kept. The least frecent ones are dropped on save
+max_entries = 5000
+
+# Visits queued before the store is written
+batch_size = 16
+
+# Where the store is kept between runs
+path = cache_path('frecency')
+
+# Bumped whenever the format of the store changes
+version = 1
+
+# String -> log2 of the sum of its visit weights. None until loaded
+scores = None
+
+# [(string, time)] not written yet
+pending = []
+
+# Incremented whenever scores change
+generation = 0
+
+# Column -> (generation, ranking, number of strings ranked). See 'ranking'
+rankings = WeakKeyDictionary()
+
+
+# float -> float -> float
+def log_add(a, b):
+    ''' log2(2 ** a + 2 ** b), without overflowing '''
+    high, low = max(a, b), min(a, b)
+    return high + math.log(1 + 2 ** (low - high), 2)
+
+
+def loaded():
+    global scores, generation
+    if scores is None:
+        scores = load()
+        generation += 1
+        for entry in pending:
+            apply_visit(scores, entry)
+    return scores
+
+
+def load():
+    try:
+        with open(path, 'rb') as f:
+            stored_version, strings, values = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return {}
+    if stored_version != version or not strings:
+        return {}
+    return dict(zip(strings.split('\0'), array('d', values)))
+
+
+def save():
+    ''' Merge the queued visits into the store on disk '''
+    global scores, pending, generation
+    if not pending:
+        return
+    merged = load()
+    for entry in pending:
+        apply_visit(merged, entry)
+    if len(merged) > max_entries:
+        kept = sorted(merged, key=merged.__getitem__, reverse=True)[:max_entries]
+        merged = dict((x, merged[x]) for x in kept)
+    scores, pending = merged, []
+    generation += 1
+    strings = merged.keys()
+    atomic_marshal_dump(path, (version, '\0'.join(strings), array('d', map(merged.get, strings)).tostring()))
+
+
+def apply_visit(store, visit):
+    string, when = visit
+    weight = when / float(half_life)
+    store[string] = log_add(store[string], weight) if string in store else weight
+
+
+def visit(string):
+    ''' An action ran on a string '''
+    global generation
+    entry = (string, time())
+    pending.append(entry)
+    if scores is not None:
+        apply_visit(scores, entry)
+        generation += 1
+    if len(pending) >= batch_size:
+        save()
+
+
+# Column -> [(float, int)]
+def ranking(column):
+    ''' (negated score, index) of the strings of a column which were visited,
+    the most frecent first. Rankings are remembered until the next visit, and
+    only the strings appended since are looked at for columns still growing
+    (e.g. streamed or cached candidates) '''
+    store = loaded()
+    if not store:
+        return []
+    known_generation, ranked, known = rankings.get(column, (None, [], 0))
+    if known_generation != generation:
+        ranked, known = [], 0
+    if known < len(column):
+        ranked = sorted(ranked + found(store, column, known))
+        rankings[column] = (generation, ranked, len(column))
+    return ranked
+
+
+# {str: float} -> Column -> int -> [(float, int)]
+def found(store, column, start):
+    visited = set(store)
+    ranked = []
+    for first, strings in column.chunks(start):
+        # Visited strings are rare: set.intersection tells whether there are
+        # any without looking them up one by one from Python
+        hits = visited.intersection(strings)
+        if hits:
+            for i in compress(count(first), imap(hits.__contains__, strings)):
+                ranked.append((-store[strings[i - first]], i))
+    return ranked
@@ -1,10 +1,15 @@
 import re
 import funcy as fn
-from itertools import imap, ifilter
+from bisect import bisect_left
+from itertools import imap, ifilter, izip, count, repeat
 from functools import partial
 
 from . import variables
 from . import sources
+from .registry import source_signature
+from .view import Lines
+from .candidates import Ranked, Selection
+from .matcher import sort_limit
 from .exceptions import *
 
 
@@ -17,6 +22,14 @@ def escape_quote(string):
     return re.sub("'", "''", string)
 
 
+# a -> str
+def vim_literal(value):
+    ''' Vim expression for a boolean, number or string '''
+    if isinstance(value, (bool, int, long)):
+        return str(int(value))
+    return "'" + escape_quote(value) + "'"
+
+
 # str -> str
 def escape(char, string):
     return re.sub(char, '\\' + char, string)
@@ -24,7 +37,13 @@ def escape(char, string):
 
 # hashable b => (a -> b) -> [a] -> [a]
 def iuniq(func, lst):
-    return imap(fn.first, fn.group_by(func, lst).itervalues())
+    ''' First item of each key, in order, as they come '''
+    seen = set()
+    for item in lst:
+        key = func(item)
+        if key not in seen:
+            seen.add(key)
+            yield item
 
 
 # (a -> bool) -> [a] -> a
@@ -62,7 +81,7 @@ def parse_source(string):
 
 # source -> None
 def validate_source(source):
-    assert source['name'] in sources.__all__, 'Source "{}" is not recognized'.format(source['name'])
+    assert source['name'] in sources.registry, 'Source "{}" is not recognized'.format(source['name'])
     return source
 
 
@@ -98,19 +117,65 @@ def validate_state(state):
     assert state['direction'] in directions, 'Option "-direction" has to be one of {}'.format(str(directions))
 
 
-# state -> [candidates]
+# state -> Lines
 def aggregate_candidates(state):
-    return fn.iflatten(imap(lambda x: fmt_candidates(x['name'], x['candidates']), state['sources']))
+    return Lines(
+        [(x['name'], ranked_candidates(x, shown_indices(state, i))) for i, x in enumerate(state['sources'])],
+        fmt_candidates,
+        state['marked'],
+    )
+
 
+# state -> int -> [int]
+def shown_indices(state, position):
+    ''' Indices of the filtered candidates of a source, without the ones
+    hidden as duplicates. None means all of them. See unique.py '''
+    matcher = state['sources'][position]['matcher']
+    indices = matcher and matcher.indices
+    return state['uniques'].kept(position, indices) if state['uniques'] else indices
 
-# str -> [candidate] -> [candidate]
-def fmt_candidates(source_name, candidates):
-    return imap(partial(fmt_candidate, source_name), candidates)
 
+# source -> [int] -> [candidate]
+def ranked_candidates(source, indices):
+    ''' Candidates at some indices, the frecent ones first. See frecency.py '''
+    candidates = source['candidates'] if indices is None else Selection(source['candidates'], indices)
+    if not source['ranking']:
+        return candidates
+    return Ranked(candidates, top_positions([i for _, i in source['ranking']], indices))
 
-# str -> candidate -> candidate
-def fmt_candidate(source_name, candidate):
-    return '{} {} {} {}'.format(source_name, candidate.pre, candidate.filterable, candidate.post)
+
+# [int] -> [int] -> [int]
+def top_positions(ranked, indices):
+    ''' Positions of the ranked candidates among the filtered ones. Matcher
+    results too large to be sorted are in source order and can be bisected '''
+    if indices is None:
+        return ranked
+    if len(indices) > sort_limit:
+        found = ((bisect_left(indices, i), i) for i in ranked)
+        return [p for p, i in found if p < len(indices) and indices[p] == i]
+    positions = dict(izip(indices, count()))
+    return [positions[i] for i in ranked if i in positions]
+
+
+# state -> bool
+def is_streaming(state):
+    return any(fn.pluck('stream', state['sources']))
+
+
+# str -> [candidate] -> [bool] -> [str]
+def fmt_candidates(source_name, candidates, marked=None):
+    return imap(partial(fmt_candidate, source_name), candidates, marked or repeat(False))
+
+
+# str -> candidate -> bool -> str
+def fmt_candidate(source_name, candidate, marked=False):
+    return '{}{}{} {} {}'.format(source_name, '*' if marked else ' ', candidate.pre, candidate.filterable, candidate.post)
+
+
+# str -> candidate -> int
+def filterable_column(source_name, candidate):
+    ''' Byte offset of the filterable string in a line fmt_candidate made '''
+    return len(source_name) + 1 + len(candidate.pre) + 1
 
 
 # [option] -> [option]
@@ -138,7 +203,4 @@ def invalid_state(state):
 # state -> state -> bool
 def same_sources(s1, s2):
     ''' Do two states have the same sources (same names and same arguments)?  '''
-    return (
-        fn.pluck('name', s1['sources']) == fn.pluck('name', s2['sources']) and
-        fn.pluck('args', s1['sources']) == fn.pluck('args', s2['sources'])
-    )
+    return source_signature(s1) == source_signature(s2)
@@ -0,0 +1,290 @@
+''' Incremental fuzzy matching over the 'filterable' field of candidates.
+
+Every source gets an Index holding the filterable strings of its candidates,
+lowercase, joined into blocks of text. A Matcher narrows an Index down to the
+candidates matching the user input: a single regex goes through a whole block
+at once, one line per candidate. When the input grows, only the lines which
+matched the previous query are searched again. Work is done a block at a time
+and stops at a deadline so that a keystroke never blocks Vim for more than a
+frame; the caller resumes it later on.
+'''
+import re
+from itertools import compress, izip
+from time import time
+
+from .candidates import Selection
+
+
+# Time allowed for filtering per keystroke (in seconds)
+frame_budget = 0.016
+
+# Number of candidates per block of an Index. A block is searched at once,
+# between two looks at the clock
+block_size = 8192
+
+# Number of candidates scored between two looks at the clock
+chunk_size = 2048
+
+# Results with more matches than this are left in source order. Sorting them
+# costs more than it's worth until the query gets more specific
+sort_limit = 50000
+
+# Id of the Vim timer running while some filtering isn't done
+timer = None
+
+
+# str -> bool
+def is_case_sensitive(query):
+    ''' Smart case: only care about case if the query has uppercase letters '''
+    return query != query.lower()
+
+
+# str -> bool -> (str -> match)
+def fuzzy_search(word, case_sensitive):
+    ''' Characters of the word have to appear in order, but not necessarily
+    next to each other '''
+    pattern = '.*?'.join(map(re.escape, word))
+    return re.compile(pattern, 0 if case_sensitive else re.IGNORECASE).search
+
+
+# str -> bool -> [(str -> match)]
+def compile_query(query, case_sensitive):
+    return [fuzzy_search(word, case_sensitive) for word in query.split()]
+
+
+# str -> str
+def fuzzy_pattern(word):
+    ''' Like fuzzy_search, within a line. Each character is matched by its
+    first occurrence after the previous one: lines which don't match are
+    rejected without backtracking '''
+    return ''.join('[^\\n{0}]*{0}'.format(re.escape(x)) for x in word)
+
+
+# str -> regex
+def compile_lines(query):
+    ''' Regex finding every line of a block of text: a line gives itself
+    when it matches all the words of the query, '' when it doesn't '''
+    words = ''.join('(?={})'.format(fuzzy_pattern(x)) for x in query.split())
+    return re.compile('(?:{}([^\\n]*)|[^\\n]*)\\n'.format(words))
+
+
+# regex -> str -> ([int], str) -> ([int], [str])
+def search_block(regex, chars, block):
+    ''' Indices and lines of the candidates of a block which match. Both
+    are worked out in C, whatever the number of candidates. Blocks missing
+    one of the characters of the query aren't searched at all '''
+    indices, text = block
+    if not all(x in text for x in chars):
+        return [], []
+    lines = regex.findall(text)
+    return list(compress(indices, lines)), filter(None, lines)
+
+
+# ([int], str) -> [int] -> [str] -> ([int], str)
+def narrowed_block(block, indices, lines):
+    ''' What a longer query has to search of a block: the lines which
+    matched. None when none of them did '''
+    if not indices:
+        return None
+    if len(indices) == len(block[0]):
+        return block
+    return indices, '\n'.join(lines) + '\n'
+
+
+# str -> [(str -> match)]
+def compile_positions(query):
+    ''' Like compile_query, with a group around each character of the words
+    to tell where they matched. Only for highlighting: Python regexes can't
+    have more than 99 groups, longer words are cut '''
+    flags = 0 if is_case_sensitive(query) else re.IGNORECASE
+    return [
+        re.compile('.*?'.join('({})'.format(re.escape(x)) for x in word[:99]), flags).search
+        for word in query.split()
+    ]
+
+
+# [(str -> match)] -> str -> [(int, int)]
+def match_spans(searches, string):
+    ''' (start, length) of the runs of characters matched by the words of a
+    query, sorted and merged '''
+    positions = set()
+    for match in filter(None, (search(string) for search in searches)):
+        positions.update(match.start(g) for g in xrange(1, len(match.groups()) + 1))
+    spans = []
+    for position in sorted(positions):
+        if spans and sum(spans[-1]) == position:
+            spans[-1] = (spans[-1][0], spans[-1][1] + 1)
+        else:
+            spans.append((position, 1))
+    return spans
+
+
+# [(str -> match)] -> str -> int
+def score(searches, string):
+    ''' Sort key of a matching string packed in an int. Lower is better:
+    matches inside the last path component first, then tighter matches, then
+    shorter strings '''
+    matches = [search(string) for search in searches]
+    basename_start = string.rfind('/') + 1
+    outside_basename = any(m.start() < basename_start for m in matches)
+    span = sum(m.end() - m.start() for m in matches)
+    return (outside_basename << 40) | (min(span, 0xfffff) << 20) | min(len(string), 0xfffff)
+
+
+class Index(object):
+    ''' Precomputed filtering data of a Candidates object. It is append only
+    so that it can keep up with candidates arriving after it was created.
+
+    A block is (indices of its candidates, their filterable strings with a
+    newline after each). Blocks keeping the case of the strings are only
+    built for case sensitive queries '''
+
+    def __init__(self, candidates):
+        self.candidates = candidates
+        self.lower = []
+        self.exact = []
+
+    def __len__(self):
+        return self.lower[-1][0][-1] + 1 if self.lower else 0
+
+    def text(self, start, stop):
+        strings = self.candidates.filterable[start:stop]
+        text = '\n'.join(strings) + '\n'
+        # A newline inside a string would shift the candidates after it
+        if text.count('\n') != len(strings):
+            text = '\n'.join(x.replace('\n', ' ') for x in strings) + '\n'
+        return text
+
+    def update(self, limit=None):
+        ''' Index up to 'limit' candidates which haven't been indexed yet.
+        Returns True when all the candidates have been indexed '''
+        start = len(self)
+        stop = len(self.candidates) if limit is None else min(start + limit, len(self.candidates))
+        for first in xrange(start, stop, block_size):
+            last = min(first + block_size, stop)
+            self.lower.append((xrange(first, last), self.text(first, last).lower()))
+        return len(self) == len(self.candidates)
+
+    def blocks(self, case_sensitive, start, stop):
+        ''' Blocks of the candidates start:stop, which have been indexed '''
+        if case_sensitive:
+            for indices, _ in self.lower[len(self.exact):]:
+                self.exact.append((indices, self.text(indices[0], indices[-1] + 1)))
+        return [x for x in (self.exact if case_sensitive else self.lower) if start <= x[0][0] < stop]
+
+
+class Matcher(object):
+    ''' Filters and sorts an Index according to a query.
+
+    Complete results are kept for every query typed since the input was last
+    cleared, with the blocks of text they were found in. A new query which
+    extends one of them only needs to search those (and the candidates
+    indexed since then).
+    '''
+
+    def __init__(self, index):
+        self.index = index
+        self.query = ''
+        # Indices of the matching candidates. None means all of them
+        self.indices = None
+        # [(query, indices, number of candidates indexed at the time, blocks
+        # of the candidates which matched)]. Blocks are None when they're
+        # not known (see snapshots.py)
+        self.history = []
+        self.job = None
+
+    @property
+    def done(self):
+        return self.job is None
+
+    def candidates(self):
+        if self.indices is None:
+            return self.index.candidates
+        return Selection(self.index.candidates, self.indices)
+
+    def filter(self, query, deadline=None):
+        ''' Start matching against a new query. Returns True when done, False
+        when the deadline was hit (see 'resume') '''
+        self.query = query
+        self.job = None
+        if not query.strip():
+            self.indices = None
+            del self.history[:]
+            return True
+        while self.history and not query.startswith(self.history[-1][0]):
+            self.history.pop()
+        if self.history and self.history[-1][0] == query:
+            # Same query, but candidates may have arrived since: its own
+            # blocks are searched again along with them
+            _, indices, indexed, _ = self.history[-1]
+            if indexed == len(self.index.candidates):
+                self.indices = indices
+                return True
+            base = self.history.pop()
+        else:
+            base = self.history[-1] if self.history else None
+        self.indices = []
+        self.job = self.matching(query, base)
+        return self.resume(deadline)
+
+    def resume(self, deadline=None):
+        ''' Carry on with the current query. Returns True when done '''
+        if self.job is None:
+            return True
+        for _ in self.job:
+            if deadline is not None and time() > deadline:
+                return False
+        self.job = None
+        return True
+
+    def matching(self, query, base):
+        ''' Generator doing the actual work one block at a time. 'base' is
+        the history entry of a shorter query, if any '''
+        case_sensitive = is_case_sensitive(query)
+        regex, chars = compile_lines(query), set(query.replace(' ', ''))
+        indexed = base[2] if base else 0
+        # Results may have been restored without their index (see
+        # snapshots.py): catch up with them first
+        while len(self.index) < indexed:
+            self.index.update(min(block_size, indexed - len(self.index)))
+            yield
+        if not base:
+            blocks = []
+        elif base[3] is None or is_case_sensitive(base[0]) != case_sensitive:
+            blocks = self.index.blocks(case_sensitive, 0, indexed)
+        else:
+            blocks = base[3]
+        # Lines of the results, as long as there are few enough to be sorted
+        matched, narrowed = [], []
+
+        def search(block):
+            indices, lines = search_block(regex, chars, block)
+            self.indices.extend(indices)
+            if len(self.indices) <= sort_limit:
+                matched.extend(lines)
+            narrowed.append(narrowed_block(block, indices, lines))
+
+        # Candidates which matched a shorter query
+        for block in blocks:
+            search(block)
+            yield
+        # Candidates which were never looked at with a shorter query
+        while True:
+            done = self.index.update(block_size)
+            stop = len(self.index)
+            for block in self.index.blocks(case_sensitive, indexed, stop):
+                search(block)
+                yield
+            indexed = stop
+            if done:
+                break
+
+        if len(self.indices) <= sort_limit:
+            searches = compile_query(query, case_sensitive)
+            keys = {}
+            for start in range(0, len(matched), chunk_size):
+                for i, string in izip(self.indices[start:start + chunk_size], matched[start:start + chunk_size]):
+                    keys[i] = score(searches, string)
+                yield
+            self.indices.sort(key=keys.__getitem__)
+        self.history.append((query, self.indices, indexed, filter(None, narrowed)))
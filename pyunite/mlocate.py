@@ -0,0 +1,114 @@
+''' Reader of mlocate databases (see mlocate.db(5)), so that the locate source
+doesn't have to run locate(1) and copy its whole output.
+
+    header:    '\\0mlocate', configuration size (4 bytes, big endian), version
+               (1 byte), visibility flag (1 byte), 2 bytes of padding, root
+               path and configuration block
+    directory: seconds (8 bytes), nanoseconds (4 bytes), 4 bytes of padding,
+               path, entries
+    entry:     type (1 byte: 0 file, 1 directory) and name, or type 2 which
+               ends the entries of a directory
+
+Paths and names are NUL terminated. The database is memory mapped and only
+the directories under the requested prefix are decoded: the first one is
+found with mmap.find (names can't contain '/', so only directory paths can
+match an absolute prefix) and, since updatedb writes directories sorted with
+'/' before any other character, the scan stops at the first directory out of
+the prefix.
+
+plocate databases are compressed and not supported.
+'''
+import os
+import re
+import mmap
+import struct
+
+
+magic = '\0mlocate'
+
+version = 0
+
+# Seconds, nanoseconds and padding preceding the path of a directory
+directory_header = struct.Struct('>QII')
+
+# Entries of a directory up to (and without) its end marker
+directory_entries = re.compile(r'(?:[\x00\x01][^\x00]*\x00)*')
+
+# Name of each entry. The type of files is a NUL byte too, so entries can't
+# just be split on NULs
+entry_name = re.compile(r'[\x00\x01]([^\x00]*)\x00')
+
+
+class Database(object):
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self.map[:len(magic)] != magic or ord(self.map[12]) != version:
+                raise ValueError('Not an mlocate database: ' + path)
+            config_size, = struct.unpack('>I', self.map[8:12])
+            self.check_visibility = self.map[13] != '\0'
+            root_end = self.map.find('\0', 16)
+            self.root = self.map[16:root_end]
+            # Position of the first directory
+            self.start = root_end + 1 + config_size
+        except:
+            self.map.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.map.close()
+
+    def first_directory(self, prefix):
+        ''' Position of the path of the first directory which is 'prefix' or
+        under it, -1 if there's none '''
+        position = self.start + directory_header.size
+        while True:
+            position = self.map.find(prefix, position)
+            if position < 0 or self.is_directory_path(position):
+                return position
+            position += 1
+
+    def is_directory_path(self, position):
+        ''' Whether a match of an absolute path is the path of a directory and
+        not part of one (or a coincidence in the binary header) '''
+        header = position - directory_header.size
+        if header < self.start:
+            return False
+        _, nanoseconds, padding = directory_header.unpack(self.map[header:position])
+        boundary = header == self.start or self.map[header - 1] == '\x02'
+        return boundary and padding == 0 and nanoseconds < 1000000000
+
+    def paths(self, prefix, chunk_size=65536):
+        ''' Paths of the files and directories under 'prefix' (an absolute
+        path) including itself, in chunks of about 'chunk_size' '''
+        prefix = prefix.rstrip('/') or '/'
+        under = '/' if prefix == '/' else prefix + '/'
+        position = self.first_directory(prefix)
+        chunk = []
+        first = True
+        while 0 <= position < len(self.map):
+            end = self.map.find('\0', position)
+            directory = self.map[position:end]
+            if directory != prefix and not directory.startswith(under):
+                break
+            if first:
+                # Directories come after their parent, so the parent of the
+                # first one isn't in the prefix: its path isn't an entry
+                chunk.append(directory)
+                first = False
+            match = directory_entries.match(self.map, end + 1)
+            if not self.check_visibility or os.access(directory, os.R_OK | os.X_OK):
+                head = directory + '/' if directory != '/' else '/'
+                chunk.extend(head + x for x in entry_name.findall(match.group()))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+            # Skip the end marker and the header of the next directory
+            position = match.end() + 1 + directory_header.size
+        if chunk:
+            yield chunk
@@ -0,0 +1,219 @@
+''' Previews of files in the preview window, read in the background.
+
+Only the first 'height' lines of a file are read, or the ones around a target
+line (e.g. a grep match), and never more than 'max_bytes'. Reads happen on a
+background thread. Only the latest request is served: a newer one cancels the
+read in progress, so scrolling through candidates never queues up reads. A
+timer shows the preview once it's read.
+
+Previews are kept in a LRU cache keyed by path, modification time and target
+line. Cached previews are shown right away.
+'''
+import os
+import re
+import vim
+from threading import Thread, Condition
+from collections import OrderedDict
+
+from .batch import batched, command
+from .decorators import export
+from .helpers import vim_literal
+
+
+# Lines shown in a preview
+height = 40
+
+# Lines shown above the target line
+context = 5
+
+# Max number of bytes read for a preview
+max_bytes = 1 << 17
+
+# Bytes read at a time when looking for a target line
+chunk_bytes = 1 << 16
+
+# Max number of previews cached
+cache_size = 128
+
+# Milliseconds between two looks at whether the preview has been read
+poll_interval = 10
+
+buffer_name = 'pyunite-preview'
+
+# (path, mtime, line) -> [str]
+cache = OrderedDict()
+
+# Request being read, or waiting to be: (path, line)
+pending = None
+
+# Last request read: ((path, line), lines)
+finished = None
+
+# Guards the variables above and the cache, shared with the reader thread
+condition = Condition()
+
+reader = None
+
+# Latest request shown, and the timer waiting for it to be read
+latest = None
+timer = None
+
+
+# str -> (str, int or None)
+def parsed(string):
+    ''' 'path' or 'path:line', like the grep source gives '''
+    match = re.match(r'^(.*):(\d+):?$', string)
+    if match and not os.path.exists(string):
+        return match.group(1), int(match.group(2))
+    return string, None
+
+
+def request(path, line=None):
+    ''' Lines of the preview if they're cached. Otherwise they're read in the
+    background (see 'read_finished') and None is returned '''
+    global pending, reader
+    try:
+        key = (path, os.stat(path).st_mtime, line)
+    except OSError:
+        return ['Cannot read ' + path]
+    with condition:
+        if key in cache:
+            # Whatever is being read isn't wanted anymore
+            pending = None
+            cache[key] = cache.pop(key)
+            return cache[key]
+        pending = (path, line)
+        condition.notify()
+    if reader is None:
+        reader = Thread(target=read_requests)
+        reader.daemon = True
+        reader.start()
+    return None
+
+
+def read_finished(request):
+    ''' (lines of the preview once it's read or None, whether it's still
+    being read or waiting to be) '''
+    with condition:
+        if finished and finished[0] == request:
+            return finished[1], False
+        return None, pending == request
+
+
+def read_requests():
+    global pending, finished
+    while True:
+        with condition:
+            while pending is None:
+                condition.wait()
+            request = pending
+        lines = read_preview(request, lambda: pending != request)
+        with condition:
+            if pending == request:
+                pending, finished = None, (request, lines)
+
+
+def read_preview(request, cancelled):
+    ''' Lines for a preview, None if it was cancelled meanwhile '''
+    path, line = request
+    try:
+        key = (path, os.stat(path).st_mtime, line)
+        with open(path, 'rb') as f:
+            lines = head_lines(f) if line is None else lines_around(f, line, cancelled)
+    except (IOError, OSError) as e:
+        return ['Cannot read {}: {}'.format(path, e.strerror)]
+    if lines is not None:
+        with condition:
+            cache[key] = lines
+            while len(cache) > cache_size:
+                cache.popitem(last=False)
+    return lines
+
+
+def head_lines(f):
+    data = f.read(max_bytes)
+    if '\0' in data:
+        return ['Binary file']
+    return data.splitlines()[:height]
+
+
+def lines_around(f, line, cancelled):
+    ''' Only newlines are counted on the way to the target line, one chunk
+    at a time. Gives up when the request is cancelled '''
+    first = max(1, line - context)
+    seen = 1
+    data = ''
+    while seen < first:
+        if cancelled():
+            return None
+        data = f.read(chunk_bytes)
+        if not data:
+            return []
+        newlines = data.count('\n')
+        if seen + newlines >= first:
+            data = data[nth_index(data, '\n', first - seen) + 1:]
+            seen = first
+        else:
+            seen += newlines
+    if not data:
+        return head_lines(f)
+    data += f.read(max(0, max_bytes - len(data)))
+    return data.splitlines()[:height]
+
+
+# str -> str -> int -> int
+def nth_index(string, char, n):
+    position = -1
+    for _ in xrange(n):
+        position = string.index(char, position + 1)
+    return position
+
+
+def show(string):
+    ''' Preview a file, now if it's cached or once it's been read '''
+    global latest, timer
+    latest = parsed(string)
+    if not int(vim.eval('has("timers")')):
+        return display(latest, read_preview(latest, lambda: False))
+    lines = request(*latest)
+    if lines is not None:
+        stop_timer()
+        display(latest, lines)
+    elif timer is None:
+        timer = vim.eval("timer_start({}, function('s:{}'), {{'repeat': -1}})".format(
+            poll_interval,
+            on_preview_timer.func_name,
+        ))
+
+
+@export()
+def on_preview_timer(timer_id):
+    ''' Show the latest preview once it's read. Older ones are never shown.
+    The timer stops once there's nothing left to wait for '''
+    lines, reading = read_finished(latest)
+    if lines is not None:
+        display(latest, lines)
+    if not reading:
+        stop_timer()
+
+
+def stop_timer():
+    global timer
+    if timer is not None:
+        vim.eval('timer_stop({})'.format(timer))
+        timer = None
+
+
+def display(request, lines):
+    ''' Write lines to the preview buffer with the syntax of the file, the
+    target line at the top. The current window stays current '''
+    path, line = request
+    with batched():
+        command('silent noautocmd pedit! ' + buffer_name)
+        command('noautocmd wincmd P')
+        command('setlocal buftype=nofile bufhidden=wipe noswapfile filetype=')
+    vim.current.buffer[:] = lines or ['']
+    with batched():
+        command("execute 'doautocmd filetypedetect BufRead' fnameescape({})".format(vim_literal(path)))
+        command('normal! {}Gzt'.format(line - max(1, line - context) + 1 if line else 1))
+        command('noautocmd wincmd p')
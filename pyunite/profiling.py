@@ -0,0 +1,185 @@
+''' Opt-in instrumentation of PyUnite's phases.
+
+Instrumented functions (see 'instrumented' and 'phase') record, for every
+call, its wall time, the number of candidates it dealt with and the number of
+calls it made through the Python/Vim bridge (vim.command and vim.eval, which
+are wrapped while profiling is enabled). Records are kept in a ring buffer.
+
+Nothing is recorded, and the bridge isn't wrapped, unless 'enable' has been
+called (:PyUniteProfile on). A single PyUniteStart can also be run under
+cProfile (:PyUniteProfile cprofile).
+'''
+import vim
+import json
+import cProfile
+import pstats
+from StringIO import StringIO
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from time import time
+
+
+enabled = False
+
+# Number of phase invocations kept
+size = 512
+
+# Invocations of instrumented phases, in the order they finished
+records = deque(maxlen=size)
+
+# Bridge calls made while enabled, by kind
+calls = dict(command=0, eval=0)
+
+# Whether the next PyUniteStart runs under cProfile, and the report of the
+# last one which did
+capture = False
+captured = ''
+
+# Functions of the vim module wrapped to count calls, and their originals
+bridge = {}
+
+# Number of phases currently running, to tell nested ones apart
+depth = 0
+
+# Lines of the cProfile report kept
+cprofile_lines = 40
+
+
+def counted(kind, func):
+    def wrapper(*args):
+        calls[kind] += 1
+        return func(*args)
+    return wrapper
+
+
+def enable():
+    global enabled
+    if not enabled:
+        for kind in calls:
+            bridge[kind] = getattr(vim, kind)
+            setattr(vim, kind, counted(kind, bridge[kind]))
+        enabled = True
+
+
+def disable():
+    global enabled
+    if enabled:
+        for kind, func in bridge.items():
+            setattr(vim, kind, func)
+        bridge.clear()
+        enabled = False
+
+
+def clear():
+    global captured
+    records.clear()
+    captured = ''
+
+
+@contextmanager
+def phase(name):
+    ''' Record the enclosed code as a phase. The caller can set the number of
+    candidates on the record it's given '''
+    global depth
+    if not enabled:
+        yield {}
+        return
+    record = dict(name=name, depth=depth, start=time(), candidates=None)
+    before = sum(calls.values())
+    depth += 1
+    try:
+        yield record
+    finally:
+        depth -= 1
+        record['wall'] = time() - record['start']
+        record['calls'] = sum(calls.values()) - before
+        records.append(record)
+
+
+def instrumented(count=None):
+    ''' Record every call of the decorated function as a phase named after
+    it. 'count' gets the result and the arguments and returns the number of
+    candidates '''
+    def wrapper(func):
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with phase(func.func_name) as record:
+                result = func(*args, **kwargs)
+                record['candidates'] = count and count(result, *args, **kwargs)
+                return result
+        return wrapped
+    return wrapper
+
+
+@contextmanager
+def cprofiled():
+    ''' Run the enclosed code under cProfile if a capture was asked for '''
+    global capture, captured
+    if not capture:
+        yield
+        return
+    capture = False
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        output = StringIO()
+        pstats.Stats(profile, stream=output).sort_stats('cumulative').print_stats(cprofile_lines)
+        captured = output.getvalue()
+
+
+# [record] -> OrderedDict
+def summary(records):
+    ''' Aggregated records of each phase, in order of first appearance '''
+    phases = OrderedDict()
+    for record in records:
+        phases.setdefault(record['name'], []).append(record)
+    return OrderedDict(
+        (name, dict(
+            count = len(rs),
+            total = sum(r['wall'] for r in rs),
+            max = max(r['wall'] for r in rs),
+            last = rs[-1]['wall'],
+            calls = sum(r['calls'] for r in rs),
+            candidates = rs[-1]['candidates'],
+        ))
+        for name, rs in phases.items()
+    )
+
+
+# [record] -> [str]
+def report(records, recent=20):
+    lines = ['{:<24}{:>7}{:>11}{:>11}{:>11}{:>11}{:>8}{:>12}'.format(
+        'phase', 'calls', 'total ms', 'mean ms', 'max ms', 'last ms', 'bridge', 'candidates')]
+    for name, s in summary(records).items():
+        lines.append('{:<24}{:>7}{:>11.1f}{:>11.2f}{:>11.1f}{:>11.1f}{:>8}{:>12}'.format(
+            name, s['count'], s['total'] * 1000, s['total'] * 1000 / s['count'],
+            s['max'] * 1000, s['last'] * 1000, s['calls'],
+            '-' if s['candidates'] is None else s['candidates'],
+        ))
+    lines += ['', 'Most recent (nested phases are indented):']
+    for record in sorted(list(records)[-recent:], key=lambda x: x['start']):
+        lines.append('{:<32}{:>9.1f} ms{:>8} calls{:>12}'.format(
+            '  ' * record['depth'] + record['name'],
+            record['wall'] * 1000,
+            record['calls'],
+            '' if record['candidates'] is None else record['candidates'],
+        ))
+    if captured:
+        lines += ['', 'cProfile of the last captured PyUniteStart:'] + captured.splitlines()
+    return lines
+
+
+def dump(path):
+    ''' Write the records and their summary as JSON '''
+    with open(path, 'w') as f:
+        json.dump(dict(
+            records = list(records),
+            summary = summary(records),
+            cprofile = captured,
+        ), f, indent=2)
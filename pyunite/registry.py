@@ -0,0 +1,74 @@
+''' Registry of PyUnite states.
+
+States are kept by uid, in the order they were added, and indexed by
+container, by container and source signature, and by buffer number so that
+none of the lookups PyUnite does on every command or event scans all of them.
+A state must not change its container, sources or buffer while registered.
+'''
+from collections import OrderedDict
+
+
+# state -> hashable
+def source_signature(state):
+    ''' Names and arguments of the sources of a state '''
+    return tuple((x['name'], tuple(x['args'])) for x in state['sources'])
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.by_uid = OrderedDict()
+        # Container -> {uid: state}
+        self.by_container = {}
+        # (container, source signature) -> {uid: state}
+        self.by_sources = {}
+        # Buffer number -> state
+        self.by_buffer = {}
+
+    def __len__(self):
+        return len(self.by_uid)
+
+    def __iter__(self):
+        # A copy, so that states can be removed while iterating
+        return iter(self.by_uid.values())
+
+    def __contains__(self, state):
+        return state['uid'] in self.by_uid
+
+    def get(self, uid):
+        return self.by_uid.get(uid)
+
+    def add(self, state):
+        self.by_uid[state['uid']] = state
+        self.by_container.setdefault(state['container'], OrderedDict())[state['uid']] = state
+        key = (state['container'], source_signature(state))
+        self.by_sources.setdefault(key, OrderedDict())[state['uid']] = state
+        self.by_buffer[state['buffer'].number] = state
+
+    def remove(self, state):
+        del self.by_uid[state['uid']]
+        discard(self.by_container, state['container'], state['uid'])
+        discard(self.by_sources, (state['container'], source_signature(state)), state['uid'])
+        if self.by_buffer.get(state['buffer'].number) is state:
+            del self.by_buffer[state['buffer'].number]
+
+    def in_container(self, container):
+        return self.by_container.get(container, {}).values()
+
+    def with_sources(self, container, signature):
+        return self.by_sources.get((container, signature), {}).values()
+
+    def with_buffer(self, number):
+        return self.by_buffer.get(number)
+
+    def containers(self):
+        return self.by_container.keys()
+
+
+def discard(index, key, uid):
+    ''' Remove a state from an index, and its key once it's empty '''
+    states = index.get(key)
+    if states is not None:
+        states.pop(uid, None)
+        if not states:
+            del index[key]
@@ -0,0 +1,154 @@
+''' Snapshots of the states PyUnite dropped, to resume them (see -resume).
+
+A snapshot is taken whenever a state goes away (its buffer is wiped, it's
+replaced, ...) and keyed by the state's source signature. It keeps the
+sources as they were, candidates and matcher included, with the input, the
+offset of the view, the cursor line and the marked candidates: resuming only
+fills a buffer, no source runs again.
+
+Snapshots of states which were still streaming aren't taken. The least
+recently taken ones are dropped once they hold more than 'max_candidates'
+candidates, or written to 'directory' if it's set. Snapshots read back from
+there have their candidates and the results of their last query.
+'''
+import os
+import marshal
+from array import array
+from hashlib import md5
+from collections import OrderedDict
+
+from .candidates import Candidates
+from .matcher import Matcher, Index
+from .storage import atomic_marshal_dump
+from .variables import candidate, source
+
+
+# Max number of candidates held by the snapshots in memory
+max_candidates = 2000000
+
+# Where snapshots evicted from memory are written. None drops them
+directory = None
+
+# Bumped whenever the format of the files changes
+version = 1
+
+# Fields of a state kept in its snapshot
+fields = ['sources', 'input', 'offset', 'marked', 'uniques']
+
+# Source signature -> snapshot
+entries = OrderedDict()
+
+
+def size():
+    return sum(candidate_count(x) for x in entries.itervalues())
+
+
+# snapshot -> int
+def candidate_count(snapshot):
+    return sum(len(x['candidates']) for x in snapshot['sources'])
+
+
+def take(signature, state, cursor):
+    entries.pop(signature, None)
+    entries[signature] = dict(((x, state[x]) for x in fields), cursor=cursor)
+    total = size()
+    while total > max_candidates and len(entries) > 1:
+        evicted_signature, evicted = entries.popitem(last=False)
+        total -= candidate_count(evicted)
+        directory and write(evicted_signature, evicted)
+
+
+def pop(signature):
+    ''' Snapshot of a state with these sources, None if there's none. It's
+    forgotten: the resumed state takes over its sources '''
+    return entries.pop(signature, None) or read(signature)
+
+
+# Source signature -> str
+def path(signature):
+    return os.path.join(directory, md5(repr(signature)).hexdigest())
+
+
+def write(signature, snapshot):
+    atomic_marshal_dump(path(signature), (
+        version,
+        signature,
+        [(x['name'], x['args'], map(dumped_column, columns(x['candidates'])), dumped_matcher(x['matcher'])) for x in snapshot['sources']],
+        snapshot['input'],
+        snapshot['offset'],
+        [(p, tuple(x)) for p, x in snapshot['marked']],
+        snapshot['cursor'],
+    ))
+
+
+def read(signature):
+    if not directory:
+        return None
+    try:
+        with open(path(signature), 'rb') as f:
+            stored_version, stored_signature, sources, input, offset, marked, cursor = marshal.load(f)
+        os.remove(path(signature))
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+    if stored_version != version or stored_signature != signature:
+        return None
+    return dict(
+        sources = map(loaded_source, sources),
+        input = input,
+        offset = offset,
+        marked = OrderedDict(((p, candidate._make(x)), True) for p, x in marked),
+        uniques = None,
+        cursor = cursor,
+    )
+
+
+def loaded_source(stored):
+    name, args, data, matched = stored
+    candidates = loaded_candidates(data)
+    return dict(source, name=name, args=args, candidates=candidates, matcher=loaded_matcher(candidates, matched))
+
+
+# Matcher -> tuple
+def dumped_matcher(matcher):
+    ''' Results of the last query, if it was done with '''
+    if not matcher or not matcher.done or matcher.indices is None:
+        return None
+    return (matcher.query, array('L', matcher.indices).tostring(), len(matcher.index.candidates))
+
+
+# Candidates -> tuple -> Matcher
+def loaded_matcher(candidates, matched):
+    ''' A Matcher which knows the results of the last query: filtering with
+    it again doesn't look at the candidates. Its index is only built once
+    the query changes '''
+    if matched is None:
+        return None
+    query, indices, indexed = matched
+    matcher = Matcher(Index(candidates))
+    matcher.history.append((query, array('L', indices).tolist(), indexed, None))
+    return matcher
+
+
+# Candidates -> [Column]
+def columns(candidates):
+    return [candidates.pre, candidates.filterable, candidates.post]
+
+
+# Column -> tuple
+def dumped_column(column):
+    column.pack()
+    return (
+        column.blocks,
+        [None if x is None else x.tostring() for x in column.ends],
+        column.counts.tostring(),
+    )
+
+
+# [tuple] -> Candidates
+def loaded_candidates(data):
+    candidates = Candidates()
+    for column, (blocks, ends, counts) in zip(columns(candidates), data):
+        column.blocks = blocks
+        column.ends = [None if x is None else array('L', x) for x in ends]
+        column.counts = array('L', counts)
+    return candidates
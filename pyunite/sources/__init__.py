@@ -1,13 +1,37 @@
-from pathlib import Path
+''' Registry of PyUnite sources.
 
+Built-in sources are listed in a static manifest so that nothing is scanned or
+imported at startup; source modules are imported the first time they're used.
+Third-party sources are added with 'register'.
+'''
+from importlib import import_module
 
-def is_source(path):
-    return (
-        not path.is_dir() and
-        '__' not in path.stem and
-        'pyc' not in path.suffix
-    )
 
-files = Path(__file__).parent.iterdir()
+# Built-in sources. Keep it in sync with the modules of this package
+__all__ = ['arglist', 'buffer', 'file_rec', 'grep', 'locate', 'vimcmd']
 
-__all__ = map(lambda x: x.stem, filter(is_source, files))
+# Source name -> module, or dotted path of a module not imported yet
+registry = dict((name, __name__ + '.' + name) for name in __all__)
+
+# Sorted names of all the registered sources
+names = sorted(registry)
+
+# Incremented whenever a source is registered, so that tables derived from
+# the registry (e.g. command line completions) know when to rebuild
+generation = 0
+
+
+def register(name, module):
+    ''' Make a source available. 'module' is either a module object or the
+    dotted path of a module to import on first use '''
+    global names, generation
+    registry[name] = module
+    names = sorted(registry)
+    generation += 1
+
+
+def get(name):
+    module = registry[name]
+    if isinstance(module, basestring):
+        module = registry[name] = import_module(module)
+    return module
@@ -1,14 +1,21 @@
 import vim
-import re
 
-from ..core import command_output, icompact
 from ..actions import directory_actions
 from ..variables import candidate
 
 
 def get_candidates(*args):
-    lines = icompact(re.split(r'\s+', command_output('args')))
-    return map(lambda x: candidate._replace(filterable=x), lines)
+    ''' The current argument is flagged with a '%', like the current buffer
+    of the buffer source '''
+    current, arguments = vim.eval('[argidx(), argv()]')
+    return [
+        candidate._replace(pre='{:>3} {}'.format(i + 1, '%' if i == int(current) else ' '), filterable=x)
+        for i, x in enumerate(arguments)
+    ]
+
+
+# There are no events for argument list changes
+cache_ttl = 0
 
 
 actions = directory_actions
@@ -1,25 +1,100 @@
+import os
 import vim
-import re
 
-from ..core import command_output, icompact
-from ..actions import directory_actions
+from ..batch import batched, command
+from ..actions import buffer_actions
+from ..decorators import export
+from ..unique import path_key
 from ..variables import candidate
 
 
+# Numbers of the listed buffers. Filled from vim.buffers when the source is
+# first used, then kept up to date by the autocommands set at the end of this
+# module instead of being listed again
+listed = set()
+
+# For each buffer: whether it's still listed, loaded, the number of windows
+# showing it, 'modifiable', 'readonly', 'modified', the line of the cursor
+# and the name shown by :ls. All of them are fetched with one vim.eval
+buffer_info = (
+    '[buflisted(v:val), bufloaded(v:val), len(win_findbuf(v:val)), '
+    'getbufvar(v:val, "&modifiable"), getbufvar(v:val, "&readonly"), getbufvar(v:val, "&modified"), '
+    'get(get(getbufinfo(v:val), 0, {}), "lnum", 0), bufname(v:val)]'
+)
+
+
 def get_candidates(*args):
-    # Example of a candidate
+    # Example of a candidate, as :ls shows it
     # 15 %a   "pyunite/sources/buffer.py"    line 10
-    lines = icompact(command_output('ls').split('\n'))
-    to_candidate = lambda x: candidate._replace(pre=x[0], filterable=x[1])
-    return map(lambda x: to_candidate(re.split('"(.*)"', x)), lines)
+    numbers = sorted(listed)
+    current, alternate, infos = vim.eval("[bufnr('%'), bufnr('#'), map({}, '{}')]".format(
+        numbers,
+        buffer_info.replace("'", "''"),
+    ))
+    return [
+        to_candidate(number, info, number == int(current), number == int(alternate))
+        for number, info in zip(numbers, infos)
+        if info[0] == '1'
+    ]
+
+
+def to_candidate(number, info, current, alternate):
+    _, loaded, windows, modifiable, readonly, modified, line, name = info
+    flags = ''.join([
+        '%' if current else '#' if alternate else ' ',
+        ' ' if loaded == '0' else 'a' if windows != '0' else 'h',
+        '-' if modifiable == '0' else '=' if readonly == '1' else ' ',
+        '+' if modified == '1' else ' ',
+    ])
+    return candidate._replace(
+        pre = '{:>3} {} '.format(number, flags),
+        filterable = name or '[No Name]',
+        post = 'line {}'.format(line),
+    )
+
+
+@export()
+def on_buffer_listed(number):
+    listed.add(int(number))
+
 
+@export()
+def on_buffer_unlisted(number):
+    listed.discard(int(number))
 
-actions = directory_actions
+
+def set_autocommands():
+    with batched():
+        command('augroup plugin-pyunite-buffer')
+        command('autocmd!')
+        command("autocmd BufAdd * call s:{}(expand('<abuf>'))".format(on_buffer_listed.func_name))
+        command("autocmd BufDelete,BufWipeout * call s:{}(expand('<abuf>'))".format(on_buffer_unlisted.func_name))
+        command('augroup END')
+
+
+listed.update(x.number for x in vim.buffers if x.options['buflisted'])
+set_autocommands()
+
+
+# Flags shown by :ls change on about every event (BufEnter, TextChanged,
+# window changes, ...), and gathering is a single vim.eval: not cached
+cache_ttl = 0
+
+
+actions = buffer_actions
 default_action = actions['window_open']
 
 
 def actionable_string(action, candidate):
-    return candidate.filterable
+    ''' Buffers are removed by number, names can be ambiguous '''
+    return candidate.pre.split()[0] if action is actions['remove'] else candidate.filterable
+
+
+def unique_key(candidate):
+    ''' Buffers without a name are all different '''
+    if candidate.filterable == '[No Name]':
+        return candidate.pre
+    return path_key(os.getcwd(), candidate.filterable)
 
 
 def syntaxes():
@@ -0,0 +1,183 @@
+import os
+import re
+import stat
+import marshal
+from fnmatch import translate
+from hashlib import sha1
+from itertools import izip
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from time import time
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from ..actions import directory_actions
+from ..candidates import Candidates
+from ..streaming import gathered
+from ..storage import cache_path, atomic_marshal_dump
+
+
+# Names of files and directories to leave out. Ignored directories are not
+# walked into
+ignore_patterns = ['.git', '.hg', '.svn', '__pycache__', 'node_modules', '*.pyc', '*.o', '*.swp']
+
+# Number of threads listing directories. Listing mostly waits on the
+# filesystem, without holding the GIL
+walkers = 8
+
+# Where the index of each walked root is kept between runs
+index_directory = cache_path('file_rec')
+
+# Directories modified less than this many seconds before a walk started are
+# listed again on the next walk, in case they changed within the same mtime
+racy_seconds = 2
+
+# Bumped whenever the format of the index changes
+index_version = 1
+
+# Created the first time it's needed
+pool = None
+
+
+def get_candidates(*args):
+    return gathered(stream_candidates(*args))
+
+
+def stream_candidates(*args):
+    ''' Candidates are paths relative to the directory given as argument (or
+    to the current directory), prefixed with that argument '''
+    root = cache_key(*args)
+    prefix = args[0].rstrip('/') + '/' if args else ''
+    for rel, files in walked(root):
+        if files:
+            head = prefix + rel + '/' if rel else prefix
+            yield Candidates.from_columns([head + x for x in files])
+
+
+def walked(root):
+    ''' Like 'walk', with the index of root loaded before and saved after '''
+    path = index_path(root)
+    index = load_index(path)
+    fresh = {}
+    for rel, files in walk(root, index, fresh):
+        yield rel, files
+    # Unchanged entries are the very same objects, this is cheap
+    if fresh != index:
+        save_index(path, fresh)
+
+
+def walk(root, index, fresh):
+    ''' Yield (directory relative to root, file names) for every directory
+    under root, one level at a time. Directories whose mtime is the one in
+    'index' aren't listed again. The entries found end up in 'fresh' '''
+    global pool
+    if pool is None:
+        pool = ThreadPool(walkers)
+    scan = partial(scan_directory, root, index, time() - racy_seconds)
+    level = ['']
+    while level:
+        entries = pool.imap(scan, level, chunksize=16)
+        subdirectories = []
+        for rel, entry in izip(level, entries):
+            fresh[rel] = entry
+            subdirectories.extend(rel + '/' + x if rel else x for x in entry[2])
+            yield rel, entry[1]
+        level = subdirectories
+
+
+# str -> {str: entry} -> float -> str -> (float, [str], [str])
+def scan_directory(root, index, trusted_before, rel):
+    ''' Entry of a directory: (mtime, file names, subdirectory names) '''
+    path = os.path.join(root, rel)
+    try:
+        mtime = os.stat(path).st_mtime
+        cached = index.get(rel)
+        if cached and cached[0] == mtime:
+            return cached
+        files, directories = list_directory(path)
+    except OSError:
+        return (None, [], [])
+    return (mtime if mtime < trusted_before else None, files, directories)
+
+
+def list_directory(path):
+    ''' File and directory names in a directory, without the ignored ones.
+    Symbolic links are listed as files '''
+    files, directories = [], []
+    if scandir is not None:
+        for entry in scandir(path):
+            if not is_ignored(entry.name):
+                (directories if entry.is_dir(follow_symlinks=False) else files).append(entry.name)
+    else:
+        for name in os.listdir(path):
+            if not is_ignored(name):
+                is_dir = stat.S_ISDIR(os.lstat(os.path.join(path, name)).st_mode)
+                (directories if is_dir else files).append(name)
+    return files, directories
+
+
+def is_ignored(name):
+    return ignored_names.match(name) is not None
+
+
+ignored_names = re.compile('|'.join(map(translate, ignore_patterns)) or '(?!)')
+
+
+def index_path(root):
+    return os.path.join(index_directory, sha1(root).hexdigest())
+
+
+def load_index(path):
+    ''' Entries of the last walk, unless it used other ignore patterns '''
+    try:
+        with open(path, 'rb') as f:
+            version, patterns, entries = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return {}
+    if (version, patterns) != (index_version, ignore_patterns):
+        return {}
+    return entries
+
+
+def save_index(path, entries):
+    atomic_marshal_dump(path, (index_version, ignore_patterns, entries))
+
+
+# Rescanning is cheap thanks to the index: let files written from Vim show up
+cache_ttl = 30
+
+
+def cache_key(*args):
+    ''' Directory walked, which depends on the current one unless an
+    absolute path was given '''
+    return os.path.realpath(os.path.expanduser(args[0])) if args else os.getcwd()
+cache_invalidated_by = ['BufWritePost']
+
+
+thread_safe = True
+
+
+actions = directory_actions
+default_action = actions['window_open']
+
+
+def actionable_string(action, candidate):
+    return candidate.filterable
+
+
+def syntaxes():
+    return [
+        'syntax match {source}_directory /\s\zs\S*\// contained',
+    ]
+
+
+def highlights():
+    return [
+        'highlight default link {source}_directory Comment',
+    ]
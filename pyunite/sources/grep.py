@@ -0,0 +1,195 @@
+''' Search the contents of the files under a directory.
+
+    PyUnite grep:{regex}[:{directory}]
+
+Files are listed like the file_rec source does (same ignore patterns, same
+index) and handed in small batches to a pool of processes, which search them
+with a precompiled regex over a memory map. Each batch's matching lines are
+streamed back as soon as it's done, so the first ones show up while most of
+the tree hasn't even been listed yet. The processes are forked when this module
+is first imported, from Vim's main thread, and kept for the next searches.
+
+Regexes are Python ones, matched line by line ('^' and '$' match at line
+boundaries) and case insensitive unless they have uppercase letters.
+'''
+import os
+import re
+import mmap
+from itertools import count, takewhile
+from multiprocessing import Array, Pool, cpu_count
+
+from .file_rec import walked
+from ..actions import file_actions
+from ..candidates import Candidates
+from ..streaming import gathered
+from ..matcher import is_case_sensitive
+from ..exceptions import PyUniteWarning
+
+
+# Number of processes searching files
+searchers = cpu_count()
+
+# Files searched by a process at a time. Small batches get the first results
+# back sooner, big ones cost less to dispatch
+batch_files = 32
+
+# Files with a NUL byte in their first bytes are considered binary and skipped
+binary_sniff = 4096
+
+# Matching lines are cut to this many characters
+max_line_length = 200
+
+# Whether each search was cancelled, at its id modulo the number of slots.
+# Processes skip the batches of cancelled searches. Shared with them by fork
+cancelled = Array('b', 1024, lock=False)
+
+search_ids = count(1)
+
+
+def get_candidates(*args):
+    return gathered(stream_candidates(*args))
+
+
+def stream_candidates(*args):
+    ''' Candidates are 'path:line:' and the matching line. Paths are relative
+    to the directory given as argument, prefixed with it '''
+    if not args or not args[0]:
+        raise PyUniteWarning('Usage: PyUnite grep:{regex}[:{directory}]')
+    pattern = args[0]
+    root = cache_key(*args)
+    prefix = args[1].rstrip('/') + '/' if len(args) > 1 else ''
+    flags = re.MULTILINE | (0 if is_case_sensitive(pattern) else re.IGNORECASE)
+    # Invalid regexes fail here rather than in every process
+    re.compile(pattern, flags)
+
+    search_id = next(search_ids)
+    jobs = ((search_id, pattern, flags, root, files) for files in batches(root))
+    for found in searching(search_id, jobs):
+        if found:
+            yield Candidates.from_columns(
+                [x[2] for x in found],
+                pre = ['{}{}:{}:'.format(prefix, x[0], x[1]) for x in found],
+            )
+
+
+def batches(root):
+    ''' Paths of the files under root relative to it, 'batch_files' at a time '''
+    batch = []
+    for rel, files in walked(root):
+        batch.extend(os.path.join(rel, x) for x in files)
+        while len(batch) >= batch_files:
+            yield batch[:batch_files]
+            batch = batch[batch_files:]
+    if batch:
+        yield batch
+
+
+def searching(search_id, jobs):
+    ''' Results of the jobs as they're done. Stopping the iteration (e.g.
+    cancelling the stream) makes the processes drop the remaining batches of
+    this search only: several searches can run at once '''
+    slot = search_id % len(cancelled)
+    cancelled[slot] = 0
+    # Files aren't even listed anymore once the search is cancelled
+    jobs = takewhile(lambda _: not cancelled[slot], jobs)
+    try:
+        for found in pool.imap_unordered(search, jobs):
+            yield found
+    finally:
+        # Nothing is left to do after the last batch anyway
+        cancelled[slot] = 1
+
+
+def search(job):
+    ''' Runs in a searching process: (path, line number, line) of the lines
+    of some files matching a regex '''
+    search_id, pattern, flags, root, paths = job
+    regex = re.compile(pattern, flags)
+    found = []
+    for path in paths:
+        if cancelled[search_id % len(cancelled)]:
+            break
+        found.extend((path, line, text) for line, text in matching_lines(regex, os.path.join(root, path)))
+    return found
+
+
+def matching_lines(regex, path):
+    try:
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return []
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return []
+    try:
+        if '\0' in data[:binary_sniff]:
+            return []
+        return list(lines_of_matches(regex, data))
+    finally:
+        data.close()
+
+
+def lines_of_matches(regex, data):
+    ''' (line number, line) of the matches, once per line. Lines are only
+    counted between matches '''
+    line, counted, position = 1, 0, 0
+    while True:
+        match = regex.search(data, position)
+        if not match:
+            return
+        start = data.rfind('\n', 0, match.start()) + 1
+        end = data.find('\n', match.start())
+        end = len(data) if end < 0 else end
+        line += data[counted:start].count('\n')
+        counted = start
+        yield line, data[start:min(end, start + max_line_length)].rstrip('\r')
+        position = end + 1
+        if position > len(data):
+            return
+
+
+# Files may have been written since
+cache_ttl = 30
+cache_invalidated_by = ['BufWritePost']
+
+
+def cache_key(*args):
+    ''' Directory searched, which depends on the current one unless an
+    absolute path was given '''
+    return os.path.realpath(os.path.expanduser(args[1])) if len(args) > 1 else os.getcwd()
+
+
+thread_safe = True
+
+
+actions = file_actions
+default_action = actions['window_open']
+
+
+def actionable_string(action, candidate):
+    ''' The preview is shown at the matching line '''
+    path, line, _ = candidate.pre.rsplit(':', 2)
+    return '{}:{}'.format(path, line) if action is actions['preview'] else path
+
+
+def unique_key(candidate):
+    ''' Matches are the same if they're on the same line of the same file '''
+    return candidate.pre
+
+
+def syntaxes():
+    return [
+        'syntax match {source}_position /\s\zs\S\{{-}}:\d\+:/ contained',
+    ]
+
+
+def highlights():
+    return [
+        'highlight default link {source}_position Comment',
+    ]
+
+
+# Forked once the module is imported, which is on the main thread (see
+# sources.get): forking from a thread reading a stream would copy locks
+# other threads hold. Last, so that the processes know every function
+pool = Pool(searchers)
@@ -4,15 +4,69 @@ from os.path import expanduser
 from subprocess import Popen, PIPE
 from pathlib import Path
 
-from ..core import icompact
 from ..actions import directory_actions
-from ..variables import candidate
+from ..candidates import Candidates
+from ..streaming import gathered
+from ..mlocate import Database
+
+
+# Bytes of locate output turned into candidates at a time when streaming
+chunk_bytes = 1 << 20
+
+# mlocate database read directly instead of running locate, when it's
+# readable (it usually isn't for regular users). None to always run locate
+database = '/var/lib/mlocate/mlocate.db'
+
+# Paths read from the database turned into candidates at a time
+chunk_paths = 65536
 
 
 def get_candidates(*args):
-    cwd = str(Path(expanduser(args[0])).resolve()) if len(args) else getcwd()
-    lines = icompact(Popen(['locate', cwd], stdout=PIPE).communicate()[0].split('\n'))
-    return map(lambda x: candidate._replace(filterable=x), lines)
+    return gathered(stream_candidates(*args))
+
+
+def stream_candidates(*args):
+    cwd = cache_key(*args)
+    try:
+        opened = Database(database) if database else None
+    except (EnvironmentError, ValueError):
+        opened = None
+    return database_candidates(opened, cwd) if opened else locate_candidates(cwd)
+
+
+def database_candidates(opened, cwd):
+    ''' Only paths under cwd, while locate matches it anywhere in a path '''
+    with opened:
+        for paths in opened.paths(cwd, chunk_paths):
+            yield Candidates.from_columns(paths)
+
+
+def locate_candidates(cwd):
+    process = Popen(['locate', cwd], stdout=PIPE)
+    try:
+        while True:
+            lines = process.stdout.readlines(chunk_bytes)
+            if not lines:
+                break
+            yield Candidates.from_columns([x.rstrip('\n') for x in lines if x != '\n'])
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+
+
+# The locate database is usually updated daily
+cache_ttl = 600
+
+
+def cache_key(*args):
+    ''' Directory listed, which depends on the current one unless an
+    absolute path was given '''
+    return str(Path(expanduser(args[0])).resolve()) if len(args) else getcwd()
+
+
+thread_safe = True
 
 
 actions = directory_actions
@@ -10,6 +10,10 @@ def get_candidates(*args):
     return map(lambda x: candidate._replace(filterable=x), lines)
 
 
+# Command output can change at any time
+cache_ttl = 0
+
+
 actions = common_actions
 default_action = actions['nop']
 
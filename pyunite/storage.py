@@ -0,0 +1,28 @@
+''' Files kept between runs (indices, frecency, ...), under the user's cache
+directory. Several Vim instances may read and write them at the same time.
+'''
+import os
+import marshal
+
+
+# Where all the files live
+directory = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'pyunite')
+
+
+# str -> str
+def cache_path(name):
+    return os.path.join(directory, name)
+
+
+def atomic_marshal_dump(path, obj):
+    ''' Written to a temporary file first, then renamed: other Vim instances
+    never read half a file. Failures are ignored, these are only caches '''
+    temporary = '{}.{}'.format(path, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(temporary, 'wb') as f:
+            marshal.dump(obj, f)
+        os.rename(temporary, path)
+    except (IOError, OSError):
+        pass
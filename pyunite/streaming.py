@@ -0,0 +1,90 @@
+''' Candidates of slow sources can be streamed instead of gathered all at once.
+
+A source opts in by defining 'stream_candidates(*args)', a generator of chunks
+of candidates (lists or Candidates). The chunks are read on a background thread
+while Vim keeps running, and a timer periodically moves what has arrived so far
+into the source's candidate list and the PyUnite buffer. See
+core.on_stream_timer.
+'''
+from threading import Thread, Event
+from collections import deque
+
+from .candidates import Candidates
+
+
+# Milliseconds between two buffer updates
+interval = 100
+
+# Max number of candidates moved into a source per buffer update
+batch_size = 50000
+
+# Seconds to wait for the first chunk before opening the window
+first_chunk_timeout = 0.05
+
+# Id of the Vim timer running while there are streams alive
+timer = None
+
+
+# [chunk] -> Candidates
+def gathered(stream):
+    ''' All the chunks of a stream at once, for the 'get_candidates' of a
+    streaming source. Streams are read on a thread, they don't use the vim
+    module: such sources can set 'thread_safe' as well '''
+    candidates = Candidates()
+    map(candidates.extend, stream)
+    return candidates
+
+
+class Stream(object):
+    ''' Reads chunks of candidates on a background thread. They are only
+    moved into 'candidates' when 'flush' is called, so that the candidate list
+    is never touched from more than one thread '''
+
+    def __init__(self, chunks, candidates):
+        self.candidates = candidates
+        self.pending = deque()
+        self.arrived = Event()
+        self.cancelled = False
+        self.finished = False
+        self.error = None
+        self.thread = Thread(target=self.read, args=(chunks,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def read(self, chunks):
+        try:
+            for chunk in chunks:
+                if self.cancelled:
+                    getattr(chunks, 'close', lambda: None)()
+                    break
+                self.pending.append(chunk)
+                self.arrived.set()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+            self.arrived.set()
+
+    @property
+    def done(self):
+        return self.finished and not self.pending
+
+    def wait(self, timeout):
+        ''' Wait until something arrives or the stream finishes '''
+        self.arrived.wait(timeout)
+
+    def flush(self, limit=batch_size):
+        ''' Move up to about 'limit' pending candidates into 'candidates'.
+        Returns how many were moved '''
+        moved = 0
+        while self.pending and moved < limit:
+            chunk = self.pending.popleft()
+            self.candidates.extend(chunk)
+            moved += len(chunk)
+        return moved
+
+    def cancel(self):
+        ''' Stop reading. The source's generator is closed so that it can
+        clean up after itself (e.g. kill a subprocess) '''
+        self.cancelled = True
+        self.pending.clear()
@@ -0,0 +1,135 @@
+''' Hide candidates which several sources (or one source, several times) give.
+
+Each candidate gets a key, by default the absolute normalized path of its
+filterable string; a source can define 'unique_key(candidate)' instead. Only
+the hash of each key is kept, with the position of the candidate owning it.
+The first candidate of the sources listed first owns a key: when a source
+listed earlier gives the same key later on (e.g. it's streamed), ownership
+moves to its candidate and the old owner is hidden.
+
+Candidates are looked at once, as they arrive. The ones shown are given as
+indices, like the results of a Matcher. See 'Uniques.kept'.
+'''
+import os
+from array import array
+from functools import partial
+from itertools import chain, ifilterfalse, imap, repeat
+from operator import add
+
+
+# str -> (Candidates -> int -> [str])
+def filterable_paths(cwd):
+    ''' Default keys of the candidates of a source from 'start' on. Only
+    their filterable strings are read, a block at a time '''
+    return lambda candidates, start: chain.from_iterable(
+        path_keys(cwd, strings) for _, strings in candidates.filterable.chunks(start)
+    )
+
+
+# (candidate -> a) -> (Candidates -> int -> [a])
+def candidate_keys(key):
+    ''' Keys given by a source's 'unique_key(candidate)' '''
+    return lambda candidates, start: imap(key, candidates[start:])
+
+
+# str -> str -> str
+def path_key(cwd, path):
+    ''' Absolute normalized path. Symlinks aren't resolved, that would take a
+    stat per candidate '''
+    if path.startswith('~'):
+        path = os.path.expanduser(path)
+    if '/.' in path or '//' in path or path.startswith('.') or path.endswith('/'):
+        return os.path.normpath(os.path.join(cwd, path))
+    return path if path.startswith('/') else cwd + '/' + path
+
+
+# str -> [str] -> [str]
+def path_keys(cwd, paths):
+    ''' path_key of each path. Most blocks of paths are all absolute or all
+    relative, and normal already: a look at their joined text tells, and
+    they're used as they are or only prefixed with cwd '''
+    text = '\0' + '\0'.join(paths) + '\0'
+    if not any(x in text for x in ('\0~', '\0.', '/.', '//', '/\0')):
+        absolute = text.count('\0/')
+        if absolute == len(paths):
+            return paths
+        if not absolute:
+            return map(add, repeat(cwd + '/', len(paths)), paths)
+    return map(partial(path_key, cwd), paths)
+
+
+class Uniques(object):
+    ''' Owners of the keys of the candidates of a state's sources '''
+
+    def __init__(self, keys):
+        # Functions giving the keys of the candidates of each source
+        self.keys = keys
+        self.count = len(keys)
+        # hash(key) -> index * count + position of the source
+        self.owners = {}
+        # Per source: number of candidates looked at, indices of the hidden
+        # ones, incremented when those change, shown indices (None until one
+        # is hidden) and the last result of 'kept'
+        self.seen = [0] * self.count
+        self.hidden = [set() for _ in keys]
+        self.generations = [0] * self.count
+        self.shown = [None] * self.count
+        self.memo = [None] * self.count
+
+    def update(self, sources):
+        ''' Look at the candidates which arrived since the last update '''
+        changed = set()
+        for position, (source, key) in enumerate(zip(sources, self.keys)):
+            start = self.seen[position]
+            candidates = source['candidates']
+            self.seen[position] = len(candidates)
+            if start < len(candidates):
+                changed.update(self.owned(position, imap(hash, key(candidates, start)), start))
+                self.extend_shown(position, start)
+        for position in changed:
+            self.generations[position] += 1
+            self.shown[position] = array('L', ifilterfalse(self.hidden[position].__contains__, xrange(self.seen[position])))
+
+    def owned(self, position, hashes, start):
+        ''' Take the keys of new candidates. Returns the positions of the
+        sources which lost some, other than this one '''
+        owners, count, hidden = self.owners, self.count, self.hidden
+        get, losers = owners.get, set()
+        for i, h in enumerate(hashes, start):
+            owner = get(h)
+            if owner is None:
+                owners[h] = i * count + position
+            elif owner % count > position:
+                loser = owner % count
+                hidden[loser].add(owner // count)
+                losers.add(loser)
+                owners[h] = i * count + position
+            else:
+                hidden[position].add(i)
+        losers.discard(position)
+        return losers
+
+    def extend_shown(self, position, start):
+        hidden, shown = self.hidden[position], self.shown[position]
+        if shown is None and not hidden:
+            return
+        if shown is None:
+            start = 0
+            shown = self.shown[position] = array('L')
+        shown.extend(ifilterfalse(hidden.__contains__, xrange(start, self.seen[position])))
+        self.generations[position] += 1
+
+    def kept(self, position, indices):
+        ''' Indices of candidates of a source without the hidden ones. Both
+        are None when all of them are kept '''
+        hidden = self.hidden[position]
+        if not hidden:
+            return indices
+        if indices is None:
+            return self.shown[position]
+        # Matcher results keep growing while they're being filtered
+        memo = self.memo[position]
+        if not memo or memo[0] is not indices or memo[1:3] != (len(indices), self.generations[position]):
+            kept = list(ifilterfalse(hidden.__contains__, indices))
+            memo = self.memo[position] = (indices, len(indices), self.generations[position], kept)
+        return memo[3]
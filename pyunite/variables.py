@@ -1,5 +1,7 @@
 import funcy as fn
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+
+from .registry import Registry
 
 
 # Notice that 'bufhidden' is set to 'wipe' by default. This means that all
@@ -9,8 +11,8 @@ candidate = namedtuple('candidate', 'pre filterable post')(pre='', filterable=''
 
 option = namedtuple('option', 'name value')(name='', value=None)
 
-# Internally maintained list of PyUnite states.
-states = []
+# Internally maintained PyUnite states. See registry.py
+states = Registry()
 
 # Options can be specified in the PyUnite command line. They are merged into a
 # state that uniquely identifies a PyUnite buffer.
@@ -41,6 +43,22 @@ options = dict(
     close_on_action = False,
     # Leave window after performing an action on a candidate
     leave_on_action = False,
+    # Only show candidates matching this (fuzzy) input
+    input = '',
+    # Reuse candidates gathered by a previous PyUnite with the same source
+    # and arguments. See cache.py
+    cache = True,
+    # Show the candidates actions ran on most often and most recently first.
+    # See frecency.py
+    frecency = True,
+    # Preview the candidate under the cursor as it moves. See preview.py
+    preview = False,
+    # Only show the first of the candidates with the same path, e.g. a file
+    # given by several sources. Sources listed first win. See unique.py
+    unique = False,
+    # Pick up where the last PyUnite with the same sources left off: same
+    # candidates, input, cursor line and marks. See snapshots.py
+    resume = False,
 )
 
 # This state dictionary contains all the information ever needed to render a
@@ -51,6 +69,23 @@ state = fn.merge(options, dict(
     sources = [],
     # Buffer to which this state belongs to
     buffer = None,
+    # All the (filtered) candidates, formatted when read. See view.py
+    view = [],
+    # Index in 'view' of the first candidate held in the buffer
+    offset = 0,
+    # Lines held in the buffer: a window of 'view' and its placeholders
+    lines = [],
+    # (source index, candidate) of the candidates marked to run an action on
+    # them all at once, in the order they were marked. Replaced, not updated
+    marked = OrderedDict(),
+    # Candidates hidden as duplicates of others when 'unique' is set. See
+    # unique.py
+    uniques = None,
+    # (view, offset, input, first line, last line) of the lines where the
+    # input's matches are highlighted. See core.highlight_matches
+    highlighted = None,
+    # Line to put the cursor on once the window is open, when resuming
+    cursor = None,
     # Window which was active at the time of command
     window_from = None,
     # Tab which was active at the time of command
@@ -66,4 +101,11 @@ source = dict(
     name = '',
     args = [],
     candidates = [],
+    # Filters candidates according to the state's input. See matcher.py
+    matcher = None,
+    # Candidates which are still arriving. See streaming.py
+    stream = None,
+    # (negated frecency, index) of the candidates actions ran on before, the
+    # most frecent first. See frecency.py
+    ranking = [],
 )
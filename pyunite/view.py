@@ -0,0 +1,120 @@
+''' Virtualized display of candidates.
+
+The buffer of a state only holds a window of at most 'window_size' formatted
+candidates, with a placeholder line above and below it telling how many more
+there are. All the candidates stay on the Python side, in a Lines sequence
+which formats them when they're read. The window is moved (see
+core.on_cursor_moved) when the cursor gets within 'margin' lines of one of its
+ends, so opening and filtering cost the same whatever the number of
+candidates.
+'''
+from bisect import bisect_right
+
+
+# Max number of candidates held in a buffer
+window_size = 2000
+
+# The window is moved when the cursor gets this close to one of its ends
+margin = 200
+
+placeholder = '-- {:,} more --'
+
+
+class Lines(object):
+    ''' Formatted candidates of several sources, as one read-only sequence.
+    Candidates are formatted when read, only the ones read '''
+
+    def __init__(self, parts, fmt, marked=()):
+        ''' 'parts' are (source name, candidates) and 'fmt' formats some
+        candidates of a source, given whether each one is marked. 'marked'
+        holds (part index, candidate) '''
+        self.parts = parts
+        self.fmt = fmt
+        self.marked = marked
+        self.ends = []
+        total = 0
+        for _, candidates in parts:
+            total += len(candidates)
+            self.ends.append(total)
+
+    def __len__(self):
+        return self.ends[-1] if self.ends else 0
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            lines = self.range(start, stop)
+            return lines if step == 1 else lines[::step]
+        if i < 0:
+            i += len(self)
+        lines = self.range(i, i + 1)
+        if not lines:
+            raise IndexError(i)
+        return lines[0]
+
+    def __iter__(self):
+        for p, (name, candidates) in enumerate(self.parts):
+            for line in self.formatted(p, name, candidates):
+                yield line
+
+    def range(self, start, stop):
+        lines = []
+        p = bisect_right(self.ends, start)
+        while start < stop and p < len(self.parts):
+            first = self.ends[p - 1] if p else 0
+            end = min(stop, self.ends[p])
+            name, candidates = self.parts[p]
+            lines.extend(self.formatted(p, name, candidates[start - first:end - first]))
+            start, p = end, p + 1
+        return lines
+
+    def formatted(self, p, name, candidates):
+        if not self.marked:
+            return self.fmt(name, candidates)
+        candidates = list(candidates)
+        return self.fmt(name, candidates, [(p, x) in self.marked for x in candidates])
+
+    def located(self, i):
+        ''' (part index, candidate) of the i-th line '''
+        p = bisect_right(self.ends, i)
+        return p, self.parts[p][1][i - (self.ends[p - 1] if p else 0)]
+
+
+# int -> int -> int
+def clamped_offset(total, offset):
+    ''' First candidate of a window starting at 'offset', moved back so that
+    the window is full '''
+    return max(0, min(offset, total - window_size))
+
+
+# int -> int -> int
+def centered_offset(total, index):
+    return clamped_offset(total, index - window_size // 2)
+
+
+# Lines -> int -> [str]
+def window_lines(lines, offset):
+    ''' Lines held in the buffer: the window and its placeholders '''
+    stop = min(len(lines), offset + window_size)
+    above = [placeholder.format(offset)] if offset else []
+    below = [placeholder.format(len(lines) - stop)] if stop < len(lines) else []
+    return above + lines[offset:stop] + below
+
+
+# int -> int -> int
+def candidate_index(offset, line):
+    ''' Index of the candidate at a (1-based) buffer line. The placeholders
+    are at the indices right before and after the window '''
+    return offset + line - (2 if offset else 1)
+
+
+# int -> int -> int
+def buffer_line(offset, index):
+    return index - offset + (2 if offset else 1)
+
+
+# int -> int -> int -> bool
+def near_edges(total, offset, index):
+    ''' Whether the window should move for the cursor to be on 'index' '''
+    stop = min(total, offset + window_size)
+    return (offset > 0 and index < offset + margin) or (stop < total and index >= stop - margin)
@@ -0,0 +1,19 @@
+''' Bounded pool of threads for work which doesn't use the vim module. The
+vim module may only be used from Vim's main thread. '''
+from multiprocessing.pool import ThreadPool
+
+
+# Max number of threads
+size = 4
+
+# Created the first time it's needed
+pool = None
+
+
+def map_async(func, items):
+    ''' Start applying func to the items. Call get() on the result to wait
+    for the results (in the same order as the items) '''
+    global pool
+    if pool is None:
+        pool = ThreadPool(size)
+    return pool.map_async(func, items)